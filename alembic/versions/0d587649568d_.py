@@ -0,0 +1,26 @@
+"""esignature refreshed at
+
+Revision ID: 0d587649568d
+Revises: 6646878d4331
+Create Date: 2026-10-16 15:48:36.114052
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0d587649568d'
+down_revision = '6646878d4331'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('lease_esignatures', sa.Column('refreshed_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_lease_esignatures_status_refreshed_at', 'lease_esignatures', ['status', 'refreshed_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_lease_esignatures_status_refreshed_at', table_name='lease_esignatures')
+    op.drop_column('lease_esignatures', 'refreshed_at')
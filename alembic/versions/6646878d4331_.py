@@ -0,0 +1,25 @@
+"""esignature payload digest
+
+Revision ID: 6646878d4331
+Revises: d221cb8a615b
+Create Date: 2026-10-16 14:20:11.902715
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6646878d4331'
+down_revision = 'd221cb8a615b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows are left null, the next payload for them fills it in
+    op.add_column('lease_esignatures', sa.Column('data_digest', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    op.drop_column('lease_esignatures', 'data_digest')
@@ -0,0 +1,31 @@
+"""hashed access token lookup column
+
+Revision ID: 7281fd082bd2
+Revises: 4d304b4bb819
+Create Date: 2026-10-16 09:12:40.512873
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7281fd082bd2'
+down_revision = '4d304b4bb819'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('access_token_digest', sa.String(length=64), nullable=True))
+    # Revoked tokens are stored blank, their digest stays null
+    op.execute(
+        "UPDATE users SET access_token_digest = SHA2(access_token, 256) "
+        "WHERE access_token <> ''"
+    )
+    op.create_unique_constraint('uq_users_access_token_digest', 'users', ['access_token_digest'])
+
+
+def downgrade():
+    op.drop_constraint('uq_users_access_token_digest', 'users', type_='unique')
+    op.drop_column('users', 'access_token_digest')
@@ -0,0 +1,39 @@
+"""indexes for lease and esignature lookups
+
+Revision ID: d221cb8a615b
+Revises: f0fa946dd867
+Create Date: 2026-10-16 12:05:57.630418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd221cb8a615b'
+down_revision = 'f0fa946dd867'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_leases_user_id_id', 'leases', ['user_id', 'id'], unique=False)
+    op.create_index('ix_leases_user_id_unit_number', 'leases', ['user_id', 'unit_number'], unique=False)
+    op.create_index('ix_leases_user_id_bluemoon_id', 'leases', ['user_id', 'bluemoon_id'], unique=False)
+    op.create_index('ix_lease_esignatures_bluemoon_id', 'lease_esignatures', ['bluemoon_id'], unique=False)
+    op.create_index('ix_lease_esignatures_lease_id_id', 'lease_esignatures', ['lease_id', 'id'], unique=False)
+
+
+def downgrade():
+    # InnoDB silently dropped the implicit foreign key indexes once the
+    # composite ones covered user_id and lease_id, and refuses to drop the
+    # last index a foreign key needs (error 1553). Recreate them first under
+    # the names MySQL gave them.
+    if op.get_context().dialect.name == 'mysql':
+        op.create_index('user_id', 'leases', ['user_id'], unique=False)
+        op.create_index('lease_id', 'lease_esignatures', ['lease_id'], unique=False)
+    op.drop_index('ix_lease_esignatures_lease_id_id', table_name='lease_esignatures')
+    op.drop_index('ix_lease_esignatures_bluemoon_id', table_name='lease_esignatures')
+    op.drop_index('ix_leases_user_id_bluemoon_id', table_name='leases')
+    op.drop_index('ix_leases_user_id_unit_number', table_name='leases')
+    op.drop_index('ix_leases_user_id_id', table_name='leases')
@@ -0,0 +1,24 @@
+"""stored esignature document key
+
+Revision ID: f0fa946dd867
+Revises: 7281fd082bd2
+Create Date: 2026-10-16 10:41:03.228194
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f0fa946dd867'
+down_revision = '7281fd082bd2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('lease_esignatures', sa.Column('document_key', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    op.drop_column('lease_esignatures', 'document_key')
@@ -1,39 +1,97 @@
-import boto3
-import datetime
-import io
-import json
 import os
-import uuid
-from chalice import AuthResponse, Chalice, Response
-from marshmallow import ValidationError
+from chalice import AuthResponse, Chalice, Rate, Response
+from sqlalchemy.orm import selectinload
 
+from chalicelib import concurrency
 from chalicelib.bluemoon_api import BluemoonApi, BluemoonAuthorization
-from chalicelib.database import DatabaseConnection
-from chalicelib.exceptions import MissingLeaseFormsException
+from chalicelib.database import DatabaseConnection, session_scope
+from chalicelib.exceptions import InvalidCursorException, MissingLeaseFormsException
+from chalicelib.instrumentation import instrument
 from chalicelib.models import Lease, LeaseEsignature, StatusEnum
-from chalicelib.schemas import (
-    ExecuteSchema,
-    LeaseEsignatureSchema,
-    LeaseSchema,
-    LoginSchema,
-    PaginatedLeaseSchema,
-    UserSchema,
+from chalicelib.notifications import (
+    apply_notifications,
+    is_duplicate,
+    notification_buffer,
+    notification_id,
 )
+from chalicelib.reconciler import reconcile
+from chalicelib.settings import (
+    BULK_CHUNK_SIZE,
+    BULK_MAX_ROWS,
+    ESIGNATURE_STALE_SECONDS,
+    NOTIFICATIONS_MODE,
+    RECONCILE_SCHEDULE_LIMIT,
+    RECONCILE_SCHEDULE_MINUTES,
+)
+from chalicelib.storage import get_s3_client, presigned_url, upload_pdf
 from chalicelib.utils import (
     ModelFilter,
     api_error_response,
     forms_mapper,
     get_token,
     gzip_response,
+    invalidate_totals,
 )
 
-
+# marshmallow, the schemas and boto3 are imported by the routes and helpers
+# that use them, a cold start only pays for what its first request needs
 app = Chalice(app_name="the-units")
-s3_client = boto3.client("s3")
 BUCKET = os.getenv("AWS_BUCKET")
 
 
+def esignatures_loader(expand=False):
+    """Eager load esignatures, with their payload only when expanded."""
+    loader = selectinload(Lease.esignatures)
+    if expand:
+        loader = loader.undefer("data")
+    return loader
+
+
+def lease_filter(request, user_id, options=None):
+    """ModelFilter over the user's leases for the request's query parameters."""
+    filters = {
+        "fields": ["id", "bluemoon_id", "unit_number"],
+        "default_page_size": 25,
+        "default_order": "id",
+        "default_dir": "desc",
+        "default_total": "estimate",
+    }
+    return ModelFilter(
+        model=Lease,
+        filters=filters,
+        user_id=user_id,
+        params=request.query_params,
+        options=options,
+    )
+
+
+def lease_page(request, user_id):
+    """Filtered page of the user's leases, as returned by GET /leases.
+
+    Raises InvalidCursorException for a cursor the client made up or kept
+    across a change of ordering, see invalid_cursor_response.
+    """
+    from chalicelib.schemas import dump_lease_page, lease_projection
+
+    only, expand = lease_projection(request.query_params)
+    # Every lease is dumped with its esignatures, load them in one query
+    filtering = lease_filter(request, user_id, options=[esignatures_loader(expand)])
+    results = filtering.results()
+    return dump_lease_page(results, only=only, expand=expand)
+
+
+def invalid_cursor_response():
+    return gzip_response(
+        data={"message": "Invalid cursor."},
+        status_code=400,
+        request=app.current_request,
+    )
+
+
 @app.authorizer()
+# Timed like the routes, the token cache counts its hits on this timeline
+@instrument
+@session_scope
 def demo_auth(auth_request):
     """This is just the demo apps authentication check, nothing special."""
     auth_api = BluemoonAuthorization()
@@ -48,13 +106,19 @@ def demo_auth(auth_request):
 
 
 @app.route("/login", methods=["POST"], cors=True)
+@instrument
+@session_scope
 def login():
     """Dual purpose login, local and Bluemoon."""
+    from marshmallow import ValidationError
+
+    from chalicelib.schemas import LoginSchema, UserSchema, get_schema
+
     request = app.current_request
     auth_api = BluemoonAuthorization()
 
     try:
-        login_data = LoginSchema().load(request.json_body)
+        login_data = get_schema(LoginSchema).load(request.json_body)
     except ValidationError as err:
         return {"success": False, "errors": err.messages}
     results = auth_api.authenticate(
@@ -62,12 +126,13 @@ def login():
     )
     if "success" not in results or not results["success"]:
         return results
-    schema = UserSchema()
+    schema = get_schema(UserSchema)
 
     return schema.dumps(auth_api.user)
 
 
 @app.route("/", authorizer=demo_auth, methods=["GET"], cors=True)
+@instrument
 def index():
     """Fetch the details about currently logged in Bluemoon user."""
     request = app.current_request
@@ -77,14 +142,26 @@ def index():
 
 
 @app.route("/leases", authorizer=demo_auth, methods=["GET", "POST"], cors=True)
+@instrument
+@session_scope
 def leases():
     """Filters and returns list of leases or units, this is local app data."""
+    from marshmallow import ValidationError
+
+    from chalicelib.schemas import LeaseSchema
+
     request = app.current_request
     user_id = request.context["authorizer"]["principalId"]
     db = DatabaseConnection()
     session = db.session()
 
     if request.method == "POST":
+        # Reject a bad cursor before the lease is written, a retry would
+        # create it again
+        try:
+            lease_filter(request, user_id).check_cursor()
+        except InvalidCursorException:
+            return invalid_cursor_response()
         try:
             lease_data = request.json_body
             new_lease = LeaseSchema().load(lease_data, session=session)
@@ -94,33 +171,94 @@ def leases():
             new_lease.user_id = user_id
             session.add(new_lease)
             session.commit()
+            invalidate_totals(Lease, user_id)
 
-    filters = {
-        "fields": ["id", "bluemoon_id", "unit_number"],
-        "default_page_size": 25,
-        "default_order": "id",
-        "default_dir": "desc",
-    }
-    filtering = ModelFilter(
-        model=Lease, filters=filters, user_id=user_id, params=request.query_params
-    )
-    results = filtering.results()
-    schema = PaginatedLeaseSchema()
-    return gzip_response(data=schema.dump(results), status_code=200)
+    try:
+        data = lease_page(request, user_id)
+    except InvalidCursorException:
+        return invalid_cursor_response()
+    return gzip_response(data=data, status_code=200, request=app.current_request)
+
+
+@app.route("/leases/bulk", authorizer=demo_auth, methods=["POST"], cors=True)
+@instrument
+@session_scope
+def leases_bulk():
+    """Create many leases at once, valid rows are inserted in chunks.
+
+    The body is a list of leases or {"items": [...]}. Errors are returned per
+    row index, list=1 includes the first page of leases like POST /leases.
+    """
+    # Only this route needs it, and it pulls in numpy when installed
+    from chalicelib.bulk import insert_leases, load_leases
+
+    request = app.current_request
+    user_id = request.context["authorizer"]["principalId"]
+    params = request.query_params or {}
+
+    rows = request.json_body
+    if isinstance(rows, dict):
+        rows = rows.get("items")
+    if not isinstance(rows, list):
+        return gzip_response(
+            data={"success": False, "errors": {"items": ["A list is required."]}},
+            status_code=400,
+            request=app.current_request,
+        )
+    if len(rows) > BULK_MAX_ROWS:
+        message = "At most {} leases per request.".format(BULK_MAX_ROWS)
+        return gzip_response(
+            data={"success": False, "errors": {"items": [message]}},
+            status_code=413,
+            request=app.current_request,
+        )
+
+    try:
+        chunk_size = max(1, int(params.get("chunk_size", BULK_CHUNK_SIZE)))
+    except ValueError:
+        chunk_size = BULK_CHUNK_SIZE
+    list_leases = params.get("list") in ("1", "true")
+    if list_leases:
+        # Reject a bad cursor before anything is written
+        try:
+            lease_filter(request, user_id).check_cursor()
+        except InvalidCursorException:
+            return invalid_cursor_response()
+
+    valid, errors = load_leases(rows)
+    db = DatabaseConnection()
+    session = db.session()
+    created = 0
+    if valid:
+        created = insert_leases(session, user_id, valid, chunk_size=chunk_size)
+        session.commit()
+        invalidate_totals(Lease, user_id)
+
+    data = {"success": not errors, "created": created, "errors": errors}
+    if list_leases:
+        data["leases"] = lease_page(request, user_id)
+    return gzip_response(data=data, status_code=200, request=app.current_request)
 
 
 @app.route("/lease/{id}", authorizer=demo_auth, methods=["GET", "POST"], cors=True)
+@instrument
+@session_scope
 def lease(id):
     """Fetches lease unit and handles updates."""
+    from chalicelib.schemas import dump_lease, lease_projection
+
     request = app.current_request
     user_id = request.context["authorizer"]["principalId"]
 
+    only, expand = lease_projection(request.query_params)
     db = DatabaseConnection()
     session = db.session()
-    query = session.query(Lease)
+    query = session.query(Lease).options(esignatures_loader(expand))
     lease = query.filter(Lease.id == id).filter(Lease.user_id == user_id).first()
     if not lease:
-        return gzip_response(data={"message": "Not Found"}, status_code=404)
+        return gzip_response(
+            data={"message": "Not Found"}, status_code=404, request=app.current_request
+        )
 
     if request.method == "POST" and "id" in request.json_body:
         # Currently there is no update available
@@ -128,12 +266,17 @@ def lease(id):
         # session.add(lease)
         # session.commit()
 
-    return gzip_response(data=LeaseSchema().dump(lease), status_code=200)
+    data = dump_lease(lease, only=only, expand=expand)
+    return gzip_response(data=data, status_code=200, request=app.current_request)
 
 
 @app.route("/lease/callback/{id}", methods=["POST"], cors=True)
+@instrument
+@session_scope
 def lease_callback(id):
     """Fetches lease and handles the callback."""
+    from chalicelib.schemas import dump_lease
+
     # This endpoint receives the AJAX request from the lease-editor
     request = app.current_request
 
@@ -142,7 +285,9 @@ def lease_callback(id):
     query = session.query(Lease)
     lease = query.filter(Lease.id == id).first()
     if not lease:
-        return gzip_response(data={"message": "Not Found"}, status_code=404)
+        return gzip_response(
+            data={"message": "Not Found"}, status_code=404, request=app.current_request
+        )
 
     # The request body contains the full lease object but I only care about
     # the lease id
@@ -150,43 +295,59 @@ def lease_callback(id):
         lease.bluemoon_id = request.json_body["id"]
         session.add(lease)
         session.commit()
+        invalidate_totals(Lease, lease.user_id)
 
-    return gzip_response(data=LeaseSchema().dump(lease), status_code=200)
+    return gzip_response(
+        data=dump_lease(lease), status_code=200, request=app.current_request
+    )
 
 
 @app.route("/lease/forms", authorizer=demo_auth, methods=["GET", "POST"], cors=True)
+@instrument
 def lease_forms():
     bm_api = BluemoonApi(token=get_token(request=app.current_request))
     lease_forms = bm_api.lease_forms()
     if not lease_forms:
-        return api_error_response()
+        return api_error_response(request=app.current_request)
     response = {"data": lease_forms}
-    return gzip_response(data=response, status_code=200)
+    return gzip_response(data=response, status_code=200, request=app.current_request)
 
 
 @app.route(
     "/lease/request/esign/{id}", authorizer=demo_auth, methods=["POST"], cors=True
 )
+@instrument
+@session_scope
 def lease_request_esign(id):
+    from chalicelib.schemas import LeaseEsignatureSchema, get_schema
+
     request = app.current_request
     user_id = request.context["authorizer"]["principalId"]
+    token = get_token(request=app.current_request)
+    bm_api = BluemoonApi(token=token)
+    # The forms lookup does not need the lease, fetch it during the query. An
+    # unknown lease wastes the call, that is rare and it still warms the cache.
+    catalog_future = bm_api.prefetch_forms_catalog()
 
     db = DatabaseConnection()
     session = db.session()
     query = session.query(Lease)
     lease = query.filter(Lease.id == id).filter(Lease.user_id == user_id).first()
     if not lease:
-        return gzip_response(data={"message": "Not Found"}, status_code=404)
+        return gzip_response(
+            data={"message": "Not Found"}, status_code=404, request=app.current_request
+        )
 
     data = app.current_request.json_body
-    token = get_token(request=app.current_request)
     selected_forms = data.get("forms")
     try:
-        forms = forms_mapper(selected_forms=selected_forms, token=token)
-    except MissingLeaseFormsException:
-        return api_error_response()
+        catalog = concurrency.result(catalog_future)
+        forms = forms_mapper(
+            selected_forms=selected_forms, token=token, catalog=catalog
+        )
+    except (MissingLeaseFormsException, concurrency.TimeoutError):
+        return api_error_response(request=app.current_request)
 
-    bm_api = BluemoonApi(token=token)
     post_data = {
         "lease_id": lease.bluemoon_id,
         "external_id": lease.id,
@@ -196,7 +357,9 @@ def lease_request_esign(id):
     }
     response = bm_api.request_esignature(data=post_data)
     if not response.get("success"):
-        return gzip_response(data=response, status_code=200)
+        return gzip_response(
+            data=response, status_code=200, request=app.current_request
+        )
 
     lease_esignature = LeaseEsignature(
         lease_id=lease.id,
@@ -206,13 +369,17 @@ def lease_request_esign(id):
     session.add(lease_esignature)
     session.commit()
     return gzip_response(
-        data=LeaseEsignatureSchema().dump(lease_esignature), status_code=201
+        data=get_schema(LeaseEsignatureSchema).dump(lease_esignature),
+        status_code=201,
+        request=app.current_request,
     )
 
 
 @app.route(
     "/lease/esignature/pdf/{id}", authorizer=demo_auth, methods=["GET"], cors=True
 )
+@instrument
+@session_scope
 def fetch_esignature_document(id):
     """Fetch the complete lease document with receipt"""
     app.log.debug("here")
@@ -226,106 +393,122 @@ def fetch_esignature_document(id):
         query.filter(LeaseEsignature.id == id).filter(Lease.user_id == user_id).first()
     )
     if not lease_esignature:
-        return gzip_response(data={"message": "Not Found"}, status_code=404)
+        return gzip_response(
+            data={"message": "Not Found"}, status_code=404, request=app.current_request
+        )
+
+    # Executed documents no longer change, reuse the stored copy
+    cached_key = lease_esignature.cached_document_key()
+    if cached_key:
+        data = {
+            "success": True,
+            "url": presigned_url(get_s3_client(), bucket=BUCKET, key=cached_key),
+        }
+        return gzip_response(data=data, status_code=200, request=app.current_request)
 
     bm_api = BluemoonApi(token=token)
     response = bm_api.get_raw(
-        path="esignature/lease/pdf/{}".format(lease_esignature.bluemoon_id)
+        path="esignature/lease/pdf/{}".format(lease_esignature.bluemoon_id),
+        stream=True,
     )
     content_type = response.headers.get("Content-Type")
     context = {}
 
     if content_type == "application/pdf":
-        length = 0
-        mem = io.BytesIO()
-        for chunk in response.iter_content(chunk_size=128):
-            length += len(chunk)
-            mem.write(chunk)
-        mem.seek(0)
-
-        now = datetime.datetime.now()
-        file_name = "{0:%d}/{0:%m}/{1}.pdf".format(now, uuid.uuid4().hex)
-        s3_client.upload_fileobj(mem, BUCKET, file_name)
-        signed_url = s3_client.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={"Bucket": BUCKET, "Key": file_name},
-            ExpiresIn=3600,
+        cache_key = lease_esignature.document_cache_key()
+        file_name = upload_pdf(
+            response, s3_client=get_s3_client(), bucket=BUCKET, key=cache_key
         )
+        if cache_key:
+            lease_esignature.document_key = cache_key
+            session.add(lease_esignature)
+            session.commit()
         context["success"] = True
-        context["url"] = signed_url
+        context["url"] = presigned_url(get_s3_client(), bucket=BUCKET, key=file_name)
     elif content_type == "application/json":
         context.update(response.json())
+    else:
+        # Streamed and never read, hand the connection back to the pool
+        response.close()
 
-    return gzip_response(data=context, status_code=200)
+    return gzip_response(data=context, status_code=200, request=app.current_request)
 
 
 @app.route("/lease/print/{id}", authorizer=demo_auth, methods=["POST"], cors=True)
+@instrument
+@session_scope
 def lease_print(id):
     """Print requires the lease_id as it just uses that data, no esignature request."""
     user_id = app.current_request.context["authorizer"]["principalId"]
+    token = get_token(request=app.current_request)
+    bm_api = BluemoonApi(token=token)
 
     db = DatabaseConnection()
     session = db.session()
     query = session.query(Lease)
     lease = query.filter(Lease.id == id).filter(Lease.user_id == user_id).first()
     if not lease:
-        return gzip_response(data={"message": "Not Found"}, status_code=404)
+        return gzip_response(
+            data={"message": "Not Found"}, status_code=404, request=app.current_request
+        )
     if not lease.bluemoon_id:
         return gzip_response(
-            data={"message": "Bluemoon Lease not created."}, status_code=200
+            data={"message": "Bluemoon Lease not created."},
+            status_code=200,
+            request=app.current_request,
         )
 
     data = app.current_request.json_body
-    token = get_token(request=app.current_request)
     selected_forms = data.get("forms")
     try:
-        forms = forms_mapper(selected_forms=selected_forms, token=token)
-    except MissingLeaseFormsException:
-        return api_error_response()
+        # Fetched only once the lease can be printed, leases are often not in
+        # Bluemoon yet. The pool still bounds the wait.
+        catalog = concurrency.result(bm_api.prefetch_forms_catalog())
+        forms = forms_mapper(
+            selected_forms=selected_forms, token=token, catalog=catalog
+        )
+    except (MissingLeaseFormsException, concurrency.TimeoutError):
+        return api_error_response(request=app.current_request)
 
     post_data = {"lease_id": lease.bluemoon_id, "data": forms}
-    bm_api = BluemoonApi(token=token)
 
-    response = bm_api.post_raw(path="lease/generate/pdf", data=post_data)
+    response = bm_api.post_raw(path="lease/generate/pdf", data=post_data, stream=True)
     content_type = response.headers.get("Content-Type")
     context = {}
 
     if content_type == "application/pdf":
-        length = 0
-        mem = io.BytesIO()
-        for chunk in response.iter_content(chunk_size=128):
-            length += len(chunk)
-            mem.write(chunk)
-        mem.seek(0)
-
-        now = datetime.datetime.now()
-        file_name = "{0:%d}/{0:%m}/{1}.pdf".format(now, uuid.uuid4().hex)
-        s3_client.upload_fileobj(mem, BUCKET, file_name)
-        signed_url = s3_client.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={"Bucket": BUCKET, "Key": file_name},
-            ExpiresIn=3600,
-        )
+        file_name = upload_pdf(response, s3_client=get_s3_client(), bucket=BUCKET)
         context["success"] = True
-        context["url"] = signed_url
+        context["url"] = presigned_url(get_s3_client(), bucket=BUCKET, key=file_name)
     elif content_type == "application/json":
         context.update(response.json())
+    else:
+        # Streamed and never read, hand the connection back to the pool
+        response.close()
 
-    return gzip_response(data=context, status_code=200)
+    return gzip_response(data=context, status_code=200, request=app.current_request)
 
 
 @app.route("/lease/execute/{id}", authorizer=demo_auth, methods=["POST"], cors=True)
+@instrument
+@session_scope
 def lease_execute(id):
     """Execute using the lease_esignature_id as there could be more than one."""
+    from marshmallow import ValidationError
+
+    from chalicelib.schemas import ExecuteSchema, get_schema
+
     request = app.current_request
     user_id = request.context["authorizer"]["principalId"]
 
     # Validate the json request
     try:
-        execute_data = ExecuteSchema().load(request.json_body)
+        execute_data = get_schema(ExecuteSchema).load(request.json_body)
     except ValidationError as err:
         return gzip_response(
-            data={"success": False, "errors": err.messages}, status_code=200
+            data={"success": False, "errors": err.messages},
+            status_code=200,
+            request=app.current_request,
         )
 
     db = DatabaseConnection()
@@ -336,23 +519,22 @@ def lease_execute(id):
     )
     # Make sure the corresponding item exists in the database
     if not lease_esignature:
-        return gzip_response(data={"message": "Not Found"}, status_code=404)
+        return gzip_response(
+            data={"message": "Not Found"}, status_code=404, request=app.current_request
+        )
     bm_api = BluemoonApi(token=get_token(request=request))
 
-    # Update the status just in case we did not receive the latest data
-    response = bm_api.esignature_details(bm_id=lease_esignature.bluemoon_id)
-    if not response:
-        return api_error_response()
+    # Notifications and the reconciler keep the status current, only fetch it
+    # when neither has confirmed it recently
+    if lease_esignature.is_stale(ESIGNATURE_STALE_SECONDS):
+        response = bm_api.esignature_details(bm_id=lease_esignature.bluemoon_id)
+        if not response:
+            return api_error_response(request=app.current_request)
 
-    storage_data = response["data"]
-    lease_esignature.data = storage_data
-    try:
-        signers_data = storage_data["esign"]["data"]["signers"]["data"]
-        lease_esignature.transition_status(signers_data=signers_data)
-    except KeyError:
-        pass
-    session.add(lease_esignature)
-    session.commit()
+        lease_esignature.apply_payload(response["data"])
+        lease_esignature.mark_refreshed()
+        session.add(lease_esignature)
+        session.commit()
     # End status update check
 
     # Verify we can execute the document
@@ -361,7 +543,7 @@ def lease_execute(id):
             "success": False,
             "errors": [{"status": "Lease has not been signed by all residents."}],
         }
-        return gzip_response(data=data, status_code=404)
+        return gzip_response(data=data, status_code=404, request=app.current_request)
 
     # Execute the document
     response = bm_api.execute_lease(
@@ -369,28 +551,45 @@ def lease_execute(id):
     )
     # TODO: Add url to Bluemoon response and return value.
     success = "executed" in response and response["executed"]
+    if success:
+        # Don't wait for the webhook, a stored copy is now out of date
+        lease_esignature.status = StatusEnum.executed
+        lease_esignature.document_key = None
+        session.add(lease_esignature)
+        session.commit()
 
-    return gzip_response(data={"success": success}, status_code=200)
+    return gzip_response(
+        data={"success": success}, status_code=200, request=app.current_request
+    )
 
 
 @app.route("/configuration/{id}", authorizer=demo_auth, methods=["GET"], cors=True)
+@instrument
+@session_scope
 def configuration(id):
     """Fetch the configuration for Bluemoon integration."""
     user_id = app.current_request.context["authorizer"]["principalId"]
+    token = get_token(request=app.current_request)
+    bm_api = BluemoonApi(token=token)
+    # Fetched during the query, an unknown lease wastes the call but that is
+    # rare and it still warms the cache
+    property_future = bm_api.prefetch_property_number()
 
     db = DatabaseConnection()
     session = db.session()
     query = session.query(Lease)
     lease = query.filter(Lease.id == id).filter(Lease.user_id == user_id).first()
 
-    token = get_token(request=app.current_request)
-    bm_api = BluemoonApi(token=token)
+    try:
+        property_number = concurrency.result(property_future)
+    except concurrency.TimeoutError:
+        return api_error_response(request=app.current_request)
 
     # Configuration object for lease-editor. Passing in some basic data along with
     # a generated callback url
     configuration = {
         "apiUrl": bm_api.url,
-        "propertyNumber": bm_api.property_number(),
+        "propertyNumber": property_number,
         "accessToken": token,
         "view": "create",
         "callBack": "{}/lease/callback/{}".format(
@@ -400,10 +599,14 @@ def configuration(id):
             "standard": {"address": "123 Super Dr.", "unit_number": lease.unit_number}
         },
     }
-    return gzip_response(data=configuration, status_code=200)
+    return gzip_response(
+        data=configuration, status_code=200, request=app.current_request
+    )
 
 
 @app.route("/logout", authorizer=demo_auth, methods=["GET"], cors=True)
+@instrument
+@session_scope
 def logout():
     """Log the user out."""
     auth_api = BluemoonAuthorization()
@@ -411,25 +614,49 @@ def logout():
 
 
 @app.route("/notifications", methods=["POST"])
+@instrument
+@session_scope
 def notifications():
     """Lease Esignature Requests notifications from Bluemoon."""
     data = app.current_request.json_body
     # Verify the data fits the minimum standars
     if "id" not in data:
-        return gzip_response(data={"message": "Bad Request"}, status_code=405)
+        return gzip_response(
+            data={"message": "Bad Request"},
+            status_code=405,
+            request=app.current_request,
+        )
+    try:
+        bluemoon_id = notification_id(data)
+    except ValueError:
+        return gzip_response(
+            data={"message": "Bad Request"},
+            status_code=400,
+            request=app.current_request,
+        )
+
+    # Bluemoon repeats callbacks, the same payload needs no further work
+    if is_duplicate(data):
+        return {"success": True}
+
+    if NOTIFICATIONS_MODE == "queued":
+        notification_buffer.add(data)
+        return Response(body={"success": True, "queued": True}, status_code=202)
 
     db = DatabaseConnection()
     session = db.session()
-    query = session.query(LeaseEsignature)
-    lease_esignature = query.filter(LeaseEsignature.bluemoon_id == data["id"]).first()
-
-    lease_esignature.data = data
-    try:
-        # The data is a bit nested, but ideally Bluemoon API will pass a document status soon
-        signers_data = data["esign"]["data"]["signers"]["data"]
-        lease_esignature.transition_status(signers_data=signers_data)
-    except KeyError:
-        pass
-    session.add(lease_esignature)
-    session.commit()
+    unknown = apply_notifications(session, {bluemoon_id: data})
+    if unknown:
+        return gzip_response(
+            data={"message": "Not Found"}, status_code=404, request=app.current_request
+        )
     return {"success": True}
+
+
+@app.schedule(Rate(RECONCILE_SCHEDULE_MINUTES, unit=Rate.MINUTES))
+@session_scope
+def reconcile_esignatures(event):
+    """Refresh open esignatures so lease_execute can trust the local status."""
+    results = reconcile(limit=RECONCILE_SCHEDULE_LIMIT)
+    app.log.info("reconciled esignatures %s", results)
+    return results
@@ -0,0 +1,168 @@
+"""Import time per module for a cold start of the Lambda handler.
+
+Imports app in fresh interpreters, the way a new Lambda container does, and
+reports the median wall time and the median cumulative import time of app
+and of the slowest modules under it as JSON. Exits with status 1 when the
+import of app is over the budget so it can guard against regressions.
+
+    python benchmarks/cold_start.py
+    python benchmarks/cold_start.py --runs 20 --top 30 --budget-ms 400
+
+Per module times need -X importtime (Python 3.7+), older interpreters only
+report the wall time.
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+sys.path.insert(0, ROOT)
+
+from load_test import configure_environment  # noqa: E402
+
+# Cumulative import time of app, ~820ms before boto3, marshmallow, requests
+# and asyncio were imported lazily and ~180ms after
+BUDGET_MS = 400
+
+IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def parse_import_times(stderr):
+    """{module: (self us, cumulative us, parent)} from -X importtime output.
+
+    A module is listed after everything it imports, so the modules one level
+    deeper that were listed since the last line at its level are its own.
+    """
+    modules = {}
+    pending = defaultdict(list)
+    for line in stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if not match:
+            continue
+        own, cumulative, indent, name = match.groups()
+        depth = len(indent) // 2
+        for child in pending.pop(depth + 1, []):
+            modules[child] = modules[child][:2] + (name,)
+        pending[depth].append(name)
+        modules[name] = (int(own), int(cumulative), None)
+    return modules
+
+
+def import_app(module, importtime):
+    """Wall time in ms and the import times of one fresh interpreter."""
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", "import {}".format(module)]
+    start = time.perf_counter()
+    process = subprocess.run(
+        command,
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    elapsed = (time.perf_counter() - start) * 1000
+    if process.returncode:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1])
+    return elapsed, parse_import_times(process.stderr) if importtime else {}
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def summarize(module, walls, runs, top, budget_ms):
+    report = {
+        "python": sys.version.split()[0],
+        "runs": len(walls),
+        "wall_ms": round(median(walls), 1),
+        "budget_ms": budget_ms,
+    }
+    if not runs:
+        report["import_ms"] = None
+        report["over_budget"] = report["wall_ms"] > budget_ms
+        return report
+
+    own = defaultdict(list)
+    cumulative = defaultdict(list)
+    parent = {}
+    for modules in runs:
+        for name, (own_us, cumulative_us, importer) in modules.items():
+            own[name].append(own_us / 1000.0)
+            cumulative[name].append(cumulative_us / 1000.0)
+            parent[name] = importer
+
+    import_ms = median(cumulative[module])
+    report["import_ms"] = round(import_ms, 1)
+    report["over_budget"] = import_ms > budget_ms
+    # Modules imported directly by app show where the time goes, the self
+    # times show which single modules are expensive wherever they sit
+    report["imported_by_{}".format(module)] = {
+        name: round(median(cumulative[name]), 1)
+        for name in sorted(
+            (name for name in parent if parent[name] == module),
+            key=lambda name: median(cumulative[name]),
+            reverse=True,
+        )[:top]
+    }
+    report["slowest_modules"] = [
+        {
+            "module": name,
+            "self_ms": round(median(own[name]), 1),
+            "cumulative_ms": round(median(cumulative[name]), 1),
+        }
+        for name in sorted(own, key=lambda name: median(own[name]), reverse=True)[:top]
+    ]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    parser.add_argument("--output", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    # Nothing is contacted on import, these only have to be set
+    configure_environment(
+        api_url=os.getenv("API_URL", "http://127.0.0.1:9"),
+        database_url=os.getenv("DATABASE_URL", "sqlite://"),
+    )
+    os.environ.setdefault("AWS_EC2_METADATA_DISABLED", "true")
+
+    importtime = sys.version_info >= (3, 7)
+    # One run to warm the bytecode and file system caches
+    import_app(args.module, importtime)
+    walls = []
+    runs = []
+    for _ in range(args.runs):
+        wall, modules = import_app(args.module, importtime)
+        walls.append(wall)
+        if modules:
+            runs.append(modules)
+
+    report = summarize(args.module, walls, runs, args.top, args.budget_ms)
+    blob = json.dumps(report, indent=2)
+    print(blob)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(blob + "\n")
+    sys.exit(1 if report["over_budget"] else 0)
+
+
+if __name__ == "__main__":
+    main()
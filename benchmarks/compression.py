@@ -0,0 +1,95 @@
+"""CPU time per response for JSON encoding and gzip levels by body size.
+
+Builds lease list payloads of increasing size and reports the CPU time of
+stdlib json, the encoder gzip_response picks (orjson when installed) and
+gzip at several levels, along with the compressed sizes.
+
+    python benchmarks/compression.py
+    python benchmarks/compression.py --levels 1 6 9 --repeat 200
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from chalicelib.utils import json_dumps, orjson  # noqa: E402
+
+
+def payload(leases):
+    """Lease page shaped like the /leases response."""
+    return {
+        "items": [
+            {
+                "id": number,
+                "bluemoon_id": number,
+                "unit_number": "A-{}".format(number),
+                "user": 1,
+                "esignatures": [
+                    {
+                        "id": number,
+                        "bluemoon_id": number,
+                        "status": "processing",
+                        "lease_id": number,
+                    }
+                ],
+            }
+            for number in range(leases)
+        ],
+        "total": leases,
+        "pages": 1,
+        "has_next": False,
+        "has_previous": False,
+    }
+
+
+def cpu_us(func, repeat):
+    started = time.process_time()
+    for _ in range(repeat):
+        func()
+    return (time.process_time() - started) / repeat * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--leases", type=int, nargs="+", default=[0, 5, 25, 100, 1000, 10000]
+    )
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 6, 9])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    encoder = "orjson" if orjson is not None else "json compact"
+    columns = ["bytes", "json us", encoder + " us"]
+    for level in args.levels:
+        columns += ["gzip{} us".format(level), "gzip{} bytes".format(level)]
+    print("{:>7} ".format("leases") + " ".join("{:>14}".format(c) for c in columns))
+
+    for leases in args.leases:
+        data = {"message": "Not Found"} if not leases else payload(leases)
+        blob = json_dumps(data)
+        row = [
+            len(blob),
+            cpu_us(lambda: json.dumps(data).encode("utf-8"), args.repeat),
+            cpu_us(lambda: json_dumps(data), args.repeat),
+        ]
+        for level in args.levels:
+            row.append(
+                cpu_us(lambda: gzip.compress(blob, compresslevel=level), args.repeat)
+            )
+            row.append(len(gzip.compress(blob, compresslevel=level)))
+        print(
+            "{:>7} ".format(leases)
+            + " ".join(
+                "{:>14.1f}".format(v) if isinstance(v, float) else "{:>14}".format(v)
+                for v in row
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Query plans and latencies for the hot lease queries, before and after indexes.
+
+Seeds users, leases and esignatures, drops the lookup indexes declared on
+the models, runs the queries, then recreates the indexes and runs them
+again. The list queries are built by ModelFilter itself.
+
+    python benchmarks/lease_queries.py --users 100 --leases 2000
+    python benchmarks/lease_queries.py --url mysql+mysqldb://app:secret@db/bench
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from chalicelib.models import Base, Lease, LeaseEsignature, User  # noqa: E402
+from chalicelib.utils import ModelFilter  # noqa: E402
+
+LEASE_FILTERS = {
+    "fields": ["id", "bluemoon_id", "unit_number"],
+    "default_page_size": 25,
+    "default_order": "id",
+    "default_dir": "desc",
+}
+
+
+def seed(engine, users, leases_per_user, chunk_size=10000):
+    """Users with leases_per_user leases, every other lease has an esignature."""
+    with engine.begin() as connection:
+        connection.execute(
+            User.__table__.insert(),
+            [
+                {
+                    "id": user_id,
+                    "username": "user{}".format(user_id),
+                    "access_token": "",
+                }
+                for user_id in range(1, users + 1)
+            ],
+        )
+        leases = []
+        esignatures = []
+        lease_id = 0
+        for user_id in range(1, users + 1):
+            for number in range(leases_per_user):
+                lease_id += 1
+                leases.append(
+                    {
+                        "id": lease_id,
+                        "user_id": user_id,
+                        "bluemoon_id": lease_id,
+                        "unit_number": "{}-{}".format(random.choice("ABCDEF"), number),
+                    }
+                )
+                if lease_id % 2:
+                    esignatures.append(
+                        {"lease_id": lease_id, "bluemoon_id": lease_id, "data": {}}
+                    )
+        for rows, table in (
+            (leases, Lease.__table__),
+            (esignatures, LeaseEsignature.__table__),
+        ):
+            for offset in range(0, len(rows), chunk_size):
+                connection.execute(table.insert(), rows[offset : offset + chunk_size])
+    return lease_id
+
+
+def lease_list(session, user_id, params):
+    filtering = ModelFilter(
+        filters=LEASE_FILTERS, model=Lease, user_id=user_id, params=params
+    )
+    filtering.query = session.query(Lease)
+    filtering.filtering()
+    filtering.ordering()
+    return filtering.query.limit(LEASE_FILTERS["default_page_size"])
+
+
+def queries(session, users, leases):
+    """Name and query for each hot path."""
+    user_id = random.randint(1, users)
+    bluemoon_id = random.randint(1, leases)
+    return [
+        ("leases by id", lease_list(session, user_id, {})),
+        (
+            "leases by unit_number",
+            lease_list(session, user_id, {"order_by": "unit_number"}),
+        ),
+        (
+            "leases starting with unit",
+            lease_list(session, user_id, {"unit_number": "A:starts"}),
+        ),
+        (
+            "lease by bluemoon_id",
+            lease_list(session, user_id, {"bluemoon_id": "{}:eq".format(bluemoon_id)}),
+        ),
+        (
+            "notification esignature",
+            session.query(LeaseEsignature)
+            .filter(LeaseEsignature.bluemoon_id == bluemoon_id)
+            .limit(1),
+        ),
+        (
+            "lease esignatures",
+            session.query(LeaseEsignature)
+            .filter(LeaseEsignature.lease_id == bluemoon_id)
+            .order_by(LeaseEsignature.id),
+        ),
+    ]
+
+
+def explain(engine, query):
+    statement = str(
+        query.statement.compile(
+            dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+        )
+    )
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    with engine.connect() as connection:
+        return [tuple(row) for row in connection.execute(prefix + statement)]
+
+
+def run(engine, session, users, leases, repeat):
+    results = {}
+    for name, query in queries(session, users, leases):
+        plan = explain(engine, query)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            query.all()
+        elapsed = (time.perf_counter() - started) / repeat * 1000
+        results[name] = (elapsed, plan)
+    return results
+
+
+def lookup_indexes():
+    return [
+        index
+        for table in (Lease.__table__, LeaseEsignature.__table__)
+        for index in table.indexes
+    ]
+
+
+# InnoDB refuses to drop the last index a foreign key needs (error 1553), the
+# composite lookup indexes are the only ones covering user_id and lease_id. The
+# d221cb8a615b downgrade recreates these under the names MySQL gave them.
+FOREIGN_KEY_INDEXES = (("user_id", "leases"), ("lease_id", "lease_esignatures"))
+
+
+def foreign_key_indexes(engine, create):
+    if engine.dialect.name != "mysql":
+        return
+    for name, table in FOREIGN_KEY_INDEXES:
+        if create:
+            engine.execute("CREATE INDEX {0} ON {1} ({0})".format(name, table))
+        else:
+            engine.execute("DROP INDEX {} ON {}".format(name, table))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="database url, defaults to a temporary sqlite")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--leases", type=int, default=2000, help="leases per user")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--plans", action="store_true", help="print query plans")
+    args = parser.parse_args()
+
+    url = args.url
+    if not url:
+        url = "sqlite:///{}".format(os.path.join(tempfile.mkdtemp(), "leases.db"))
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    leases = seed(engine, args.users, args.leases)
+    session = sessionmaker(bind=engine)()
+
+    foreign_key_indexes(engine, create=True)
+    for index in lookup_indexes():
+        index.drop(engine)
+    random.seed(1)
+    before = run(engine, session, args.users, leases, args.repeat)
+    for index in lookup_indexes():
+        index.create(engine)
+    foreign_key_indexes(engine, create=False)
+    random.seed(1)
+    after = run(engine, session, args.users, leases, args.repeat)
+
+    print("{:<28} {:>12} {:>12}".format("query", "before ms", "after ms"))
+    for name in before:
+        print(
+            "{:<28} {:>12.3f} {:>12.3f}".format(name, before[name][0], after[name][0])
+        )
+        if args.plans:
+            for label, results in (("before", before), ("after", after)):
+                for row in results[name][1]:
+                    print("    {:<7} {}".format(label, row))
+
+
+if __name__ == "__main__":
+    main()
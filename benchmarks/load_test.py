@@ -0,0 +1,452 @@
+"""Latency, throughput and call counts for every route under fixed concurrency.
+
+Starts the stub Bluemoon API, seeds a database with users, leases and
+esignatures and drives each route in app.py in process through Chalice's
+LocalGateway, the authorizer included. Reports p50/p95/p99 latency,
+throughput, status codes, database queries, Bluemoon calls and cache hits
+per request as JSON so runs can be compared with each other.
+
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --requests 500 --concurrency 16 --latency 0.05
+    python benchmarks/load_test.py --routes leases lease --output before.json
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from stub_api import StubBluemoonApi, esignature_payload  # noqa: E402
+
+FORMS = ["LEASE", "INVENTORY", "PARKING"]
+
+
+class LocalS3(object):
+    """Enough of the S3 client for the PDF routes, keeps only the sizes."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        with self._lock:
+            self.objects[Key] = len(Body)
+        return {"ETag": '"{}"'.format(Key)}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        with self._lock:
+            self.uploads[Key] = 0
+        return {"UploadId": Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with self._lock:
+            self.uploads[UploadId] += len(Body)
+        return {"ETag": '"{}-{}"'.format(Key, PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        with self._lock:
+            self.objects[Key] = self.uploads.pop(UploadId)
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        with self._lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        return "http://s3.local/{}/{}".format(Params["Bucket"], Params["Key"])
+
+
+def configure_environment(api_url, database_url):
+    """Settings are read at import time, call this before importing app."""
+    os.environ["API_URL"] = api_url
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("AWS_BUCKET", "bench")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    os.environ.setdefault("UNITS_URL", "http://units.local")
+    os.environ.setdefault("UNITS_URL_EXTERNAL", "http://units.local")
+
+
+def thread_local_requests(app):
+    """Chalice keeps current_request on the app, give every thread its own.
+
+    Lambda only runs one request per container at a time, this lets the
+    benchmark run them side by side in one process.
+    """
+    local = threading.local()
+
+    def attribute(name):
+        return property(
+            lambda self: getattr(local, name, None),
+            lambda self, value: setattr(local, name, value),
+        )
+
+    app.__class__ = type(
+        "ThreadLocalChalice",
+        (app.__class__,),
+        {
+            "current_request": attribute("current_request"),
+            "lambda_context": attribute("lambda_context"),
+        },
+    )
+
+
+class Dataset(object):
+    """Seeded users, their leases (one esignature each) and logout users."""
+
+    def __init__(self, users, leases_per_user, logout_users):
+        self.users = users
+        self.leases_per_user = leases_per_user
+        self.logout_users = logout_users
+
+    def token(self, user_id):
+        return "token-user{}".format(user_id)
+
+    def lease_ids(self, user_id):
+        first = (user_id - 1) * self.leases_per_user + 1
+        return range(first, first + self.leases_per_user)
+
+    def seed(self, engine, chunk_size=10000):
+        from chalicelib.models import Base, Lease, LeaseEsignature, StatusEnum, User
+
+        Base.metadata.create_all(engine)
+        expires = datetime.datetime.now() + datetime.timedelta(days=1)
+        users = []
+        for user_id in range(1, self.users + self.logout_users + 1):
+            username = "user{}".format(user_id)
+            token = "token-{}".format(username)
+            users.append(
+                {
+                    "id": user_id,
+                    "username": username,
+                    "access_token": token,
+                    "access_token_digest": hashlib.sha256(
+                        token.encode("utf-8")
+                    ).hexdigest(),
+                    "refresh_token": "",
+                    "expires": expires,
+                }
+            )
+        leases = []
+        esignatures = []
+        statuses = [StatusEnum.pending, StatusEnum.processing, StatusEnum.signed]
+        for user_id in range(1, self.users + 1):
+            for lease_id in self.lease_ids(user_id):
+                leases.append(
+                    {
+                        "id": lease_id,
+                        "user_id": user_id,
+                        "bluemoon_id": lease_id,
+                        "unit_number": "U-{}".format(lease_id),
+                    }
+                )
+                esignatures.append(
+                    {
+                        "id": lease_id,
+                        "lease_id": lease_id,
+                        "bluemoon_id": lease_id,
+                        "status": statuses[lease_id % len(statuses)],
+                        "data": esignature_payload(lease_id, completed=False),
+                    }
+                )
+        with engine.begin() as connection:
+            for rows, table in (
+                (users, User.__table__),
+                (leases, Lease.__table__),
+                (esignatures, LeaseEsignature.__table__),
+            ):
+                for offset in range(0, len(rows), chunk_size):
+                    connection.execute(
+                        table.insert(), rows[offset : offset + chunk_size]
+                    )
+
+
+def auth(token):
+    return {"Authorization": "Bearer {}".format(token)}
+
+
+def build_requests(route, count, dataset, rng):
+    """count (method, path, headers, body) tuples for the route."""
+    requests = []
+    logout_users = iter(range(dataset.users + 1, dataset.users + count + 1))
+    for _ in range(count):
+        user_id = rng.randint(1, dataset.users)
+        lease_id = rng.choice(dataset.lease_ids(user_id))
+        headers = dict(auth(dataset.token(user_id)), **{"Accept-Encoding": "gzip"})
+        headers["Content-Type"] = "application/json"
+        body = None
+        if route == "login":
+            method, path = "POST", "/login"
+            headers.pop("Authorization")
+            body = {"username": "user{}".format(user_id), "password": "secret"}
+        elif route == "index":
+            method, path = "GET", "/"
+        elif route == "leases":
+            page = rng.randint(1, max(1, dataset.leases_per_user // 25))
+            method, path = "GET", "/leases?page={}".format(page)
+        elif route == "leases_create":
+            method, path = "POST", "/leases"
+            body = {"unit_number": "N-{}".format(rng.randint(1, 10**6))}
+        elif route == "leases_bulk":
+            method, path = "POST", "/leases/bulk"
+            body = [{"unit_number": "B-{}".format(number)} for number in range(25)]
+        elif route == "lease":
+            method, path = "GET", "/lease/{}".format(lease_id)
+        elif route == "lease_callback":
+            method, path = "POST", "/lease/callback/{}".format(lease_id)
+            headers.pop("Authorization")
+            body = {"id": lease_id}
+        elif route == "lease_forms":
+            method, path = "GET", "/lease/forms"
+        elif route == "lease_request_esign":
+            method, path = "POST", "/lease/request/esign/{}".format(lease_id)
+            body = {"forms": FORMS}
+        elif route == "esignature_pdf":
+            method, path = "GET", "/lease/esignature/pdf/{}".format(lease_id)
+        elif route == "lease_print":
+            method, path = "POST", "/lease/print/{}".format(lease_id)
+            body = {"forms": FORMS}
+        elif route == "lease_execute":
+            method, path = "POST", "/lease/execute/{}".format(lease_id)
+            body = {"name": "Bench Mark", "initials": "BM"}
+        elif route == "configuration":
+            method, path = "GET", "/configuration/{}".format(lease_id)
+        elif route == "notifications":
+            method, path = "POST", "/notifications"
+            headers.pop("Authorization")
+            body = esignature_payload(lease_id, completed=rng.random() < 0.5)
+        elif route == "logout":
+            method, path = "GET", "/logout"
+            headers.update(auth(dataset.token(next(logout_users))))
+        else:
+            raise ValueError("Unknown route {}".format(route))
+        requests.append(
+            (method, path, headers, json.dumps(body) if body is not None else None)
+        )
+    return requests
+
+
+ROUTES = [
+    "login",
+    "index",
+    "leases",
+    "leases_create",
+    "leases_bulk",
+    "lease",
+    "lease_callback",
+    "lease_forms",
+    "lease_request_esign",
+    "esignature_pdf",
+    "lease_print",
+    "lease_execute",
+    "configuration",
+    "notifications",
+    "logout",
+]
+
+
+def percentile(values, percent):
+    """Nearest rank percentile of sorted values."""
+    if not values:
+        return None
+    index = max(0, int(round(percent / 100.0 * len(values) + 0.5)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def cache_deltas(before, after):
+    """Hits and misses per cache between two cache_stats snapshots."""
+    return {
+        name: {
+            counter: after[name][counter] - before[name][counter]
+            for counter in ("hits", "misses")
+        }
+        for name in sorted(after)
+    }
+
+
+def summarize(latencies, statuses, elapsed, queries, upstream_calls, timelines, caches):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    totals = Counter()
+    counters = Counter()
+    for timeline in timelines:
+        for category, total in timeline.totals().items():
+            totals[category] += total["ms"]
+        counters.update(timeline.counters)
+    return {
+        "requests": count,
+        "statuses": {str(status): hits for status, hits in sorted(statuses.items())},
+        "throughput_rps": round(count / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(latencies) / count, 3) if count else None,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        },
+        "queries_per_request": round(queries / count, 2) if count else None,
+        "upstream_calls_per_request": (
+            round(sum(upstream_calls.values()) / count, 2) if count else None
+        ),
+        "upstream_calls": dict(upstream_calls),
+        "span_ms_per_request": {
+            category: round(ms / count, 3) for category, ms in sorted(totals.items())
+        },
+        # Every property or forms cache hit is a Bluemoon call saved, every
+        # token cache hit a user lookup
+        "caches": caches,
+        "counters_per_request": {
+            name: round(total / count, 3) for name, total in sorted(counters.items())
+        },
+    }
+
+
+class QueryCounter(object):
+    """Every statement the engine runs, the authorizer's included."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+
+    def after_cursor_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def run_route(gateway, requests, concurrency, stub, queries, sink):
+    from chalice.local import LocalGatewayException
+
+    from chalicelib.bluemoon_api import cache_stats
+
+    def send(request):
+        method, path, headers, body = request
+        started = time.perf_counter()
+        try:
+            status = gateway.handle_request(method, path, headers, body)["statusCode"]
+        except LocalGatewayException as error:
+            status = error.CODE
+        except Exception:
+            status = 500
+        return (time.perf_counter() - started) * 1000, status
+
+    stub.reset()
+    sink.clear()
+    queries_before = queries.count
+    caches_before = cache_stats()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, requests))
+    elapsed = time.perf_counter() - started
+    return summarize(
+        latencies=[round(latency, 3) for latency, _ in results],
+        statuses=Counter(status for _, status in results),
+        elapsed=elapsed,
+        queries=queries.count - queries_before,
+        upstream_calls=Counter(stub.calls),
+        timelines=list(sink.timelines),
+        caches=cache_deltas(caches_before, cache_stats()),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--leases", type=int, default=200, help="per user")
+    parser.add_argument("--requests", type=int, default=200, help="per route")
+    parser.add_argument("--warmup", type=int, default=10, help="per route")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02, help="stub seconds")
+    parser.add_argument("--pdf-size", type=int, default=256 * 1024, help="bytes")
+    parser.add_argument("--routes", nargs="+", choices=ROUTES, default=ROUTES)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="database url, defaults to a temporary sqlite")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    stub = StubBluemoonApi(latency=args.latency, pdf_size=args.pdf_size)
+    stub.start()
+    url = args.url
+    if not url:
+        url = "sqlite:///{}".format(os.path.join(tempfile.mkdtemp(), "load.db"))
+    configure_environment(api_url=stub.url, database_url=url)
+
+    # Imported once the environment points at the stub and the database
+    from chalice.config import Config
+    from chalice.local import LocalGateway
+
+    import app
+    from chalicelib import instrumentation
+    from chalicelib.database import DatabaseConnection
+    from chalicelib.storage import set_s3_client
+
+    logout_users = (args.requests + args.warmup) * args.routes.count("logout")
+    dataset = Dataset(args.users, args.leases, logout_users)
+    engine = DatabaseConnection().engine()
+    dataset.seed(engine)
+
+    thread_local_requests(app.app)
+    set_s3_client(LocalS3())
+    sink = instrumentation.InMemorySink()
+    instrumentation.set_sink(sink)
+    queries = QueryCounter(engine)
+    gateway = LocalGateway(app.app, Config())
+
+    rng = random.Random(args.seed)
+    report = {
+        "config": {
+            name: getattr(args, name)
+            for name in (
+                "users",
+                "leases",
+                "requests",
+                "concurrency",
+                "latency",
+                "pdf_size",
+                "seed",
+            )
+        },
+        "routes": {},
+    }
+    try:
+        for route in args.routes:
+            requests = build_requests(route, args.warmup + args.requests, dataset, rng)
+            if args.warmup:
+                run_route(
+                    gateway,
+                    requests[: args.warmup],
+                    args.concurrency,
+                    stub,
+                    queries,
+                    sink,
+                )
+            report["routes"][route] = run_route(
+                gateway, requests[args.warmup :], args.concurrency, stub, queries, sink
+            )
+    finally:
+        stub.stop()
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
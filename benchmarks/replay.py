@@ -0,0 +1,442 @@
+"""Replay a recorded JSONL request log against a local app and stub upstreams.
+
+Each line is one request, either a plain record
+
+    {"ts": 1571234567.25, "method": "GET", "path": "/leases?page=2",
+     "headers": {"Authorization": "Bearer ..."}, "body": null,
+     "status": 200, "latency_ms": 41.2}
+
+or an API Gateway proxy event (httpMethod, path, queryStringParameters,
+headers, body and requestContext.requestTimeEpoch). ts may be epoch seconds,
+epoch milliseconds or an ISO 8601 string, status and latency_ms are optional
+and are compared with the replay when present.
+
+The log is streamed, so memory does not grow with its size. Requests are sent
+at the recorded pacing divided by --speed (0 sends them as fast as the
+concurrency allows) through Chalice's LocalGateway, backed by the Bluemoon
+stub and a seeded database. Recorded tokens and ids are mapped onto the
+seeded users and leases unless --no-remap is given. --target replays against
+a running app over HTTP instead.
+
+    python benchmarks/replay.py traffic.jsonl
+    python benchmarks/replay.py traffic.jsonl --speed 10 --concurrency 16
+    python benchmarks/replay.py traffic.jsonl --target http://localhost:8000 --no-remap
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from load_test import (  # noqa: E402
+    Dataset,
+    LocalS3,
+    QueryCounter,
+    configure_environment,
+    thread_local_requests,
+)
+from stub_api import StubBluemoonApi  # noqa: E402
+
+ISO_FORMATS = (
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S",
+)
+ID_SEGMENT = re.compile(r"/(\d+)(?=/|$)")
+
+
+def parse_timestamp(value):
+    """Seconds since the epoch from a number or an ISO 8601 string."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        # Milliseconds, as API Gateway records them
+        return value / 1000.0 if value > 1e11 else float(value)
+    text = value.rstrip("Z").split("+")[0]
+    for format in ISO_FORMATS:
+        try:
+            parsed = datetime.datetime.strptime(text, format)
+        except ValueError:
+            continue
+        return (parsed - datetime.datetime(1970, 1, 1)).total_seconds()
+    raise ValueError("Unrecognised timestamp {!r}".format(value))
+
+
+class Entry(object):
+    __slots__ = ("ts", "method", "path", "headers", "body", "status", "latency_ms")
+
+    def __init__(self, ts, method, path, headers, body, status, latency_ms):
+        self.ts = ts
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+        self.status = status
+        self.latency_ms = latency_ms
+
+
+def parse_entry(record):
+    """Entry from a plain record or an API Gateway proxy event."""
+    if "httpMethod" in record:
+        path = record.get("path") or "/"
+        params = record.get("queryStringParameters") or {}
+        if params:
+            path += "?" + "&".join("{}={}".format(k, v) for k, v in params.items())
+        context = record.get("requestContext") or {}
+        ts = context.get("requestTimeEpoch")
+        method = record["httpMethod"]
+    else:
+        path = record["path"]
+        ts = record.get("ts", record.get("timestamp", record.get("time")))
+        method = record.get("method", "GET")
+    headers = dict(record.get("headers") or {})
+    body = record.get("body")
+    if body is not None and not isinstance(body, str):
+        body = json.dumps(body)
+    if body is not None and "content-type" not in (h.lower() for h in headers):
+        # Logs often drop the header, the app only parses JSON bodies
+        headers["Content-Type"] = "application/json"
+    return Entry(
+        ts=parse_timestamp(ts),
+        method=method.upper(),
+        path=path,
+        headers=headers,
+        body=body,
+        status=record.get("status", record.get("statusCode")),
+        latency_ms=record.get("latency_ms"),
+    )
+
+
+def read_entries(path, limit=None):
+    """Stream entries from the log, skipping lines that do not parse."""
+    skipped = 0
+    with open(path) as handle:
+        for number, line in enumerate(handle, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield parse_entry(json.loads(line))
+            except (ValueError, KeyError, TypeError, AttributeError):
+                skipped += 1
+                if skipped <= 10:
+                    print("Skipping line {}".format(number), file=sys.stderr)
+                continue
+            if limit is not None:
+                limit -= 1
+                if limit <= 0:
+                    return
+
+
+def stable_hash(value):
+    return int(hashlib.sha256(str(value).encode("utf-8")).hexdigest()[:12], 16)
+
+
+class Remapper(object):
+    """Maps recorded tokens and ids onto the seeded dataset, consistently.
+
+    The same recorded token always becomes the same seeded user and ids in
+    the path become one of that user's leases, so repeated requests for a
+    lease in the log hit the same local row.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def user_for(self, headers):
+        token = None
+        for name, value in headers.items():
+            if name.lower() == "authorization":
+                token = value
+        if token is None:
+            return None
+        return stable_hash(token) % self.dataset.users + 1
+
+    def lease_for(self, user_id, value):
+        lease_ids = self.dataset.lease_ids(user_id or 1)
+        return lease_ids[stable_hash(value) % len(lease_ids)]
+
+    def __call__(self, entry):
+        headers = {
+            name: value
+            for name, value in entry.headers.items()
+            if name.lower() != "authorization"
+        }
+        user_id = self.user_for(entry.headers)
+        if user_id is not None:
+            headers["Authorization"] = "Bearer {}".format(self.dataset.token(user_id))
+        path = ID_SEGMENT.sub(
+            lambda match: "/{}".format(self.lease_for(user_id, match.group(1))),
+            entry.path,
+        )
+        return entry.method, path, headers, entry.body
+
+
+class Histogram(object):
+    """Log bucketed latencies, constant memory with about 2% error."""
+
+    ratio = 1.02
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        value = max(value, 0.001)
+        self.buckets[int(math.floor(math.log(value, self.ratio)))] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(percent / 100.0 * self.count)))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return round(min(self.ratio ** (bucket + 1), self.max), 3)
+        return round(self.max, 3)
+
+    def summary(self):
+        if not self.count:
+            return None
+        return {
+            "mean": round(self.total / self.count, 3),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": round(self.max, 3),
+        }
+
+
+class RouteStats(object):
+    def __init__(self):
+        self.recorded = Histogram()
+        self.replayed = Histogram()
+        self.recorded_statuses = Counter()
+        self.replayed_statuses = Counter()
+        self.status_mismatches = 0
+
+    def summary(self):
+        return {
+            "requests": self.replayed.count,
+            "statuses": {
+                "recorded": dict(self.recorded_statuses),
+                "replayed": dict(self.replayed_statuses),
+                "mismatches": self.status_mismatches,
+            },
+            "latency_ms": {
+                "recorded": self.recorded.summary(),
+                "replayed": self.replayed.summary(),
+            },
+        }
+
+
+class Results(object):
+    def __init__(self):
+        self.routes = defaultdict(RouteStats)
+        self.unmatched = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, route, entry, status, latency_ms):
+        with self._lock:
+            stats = self.routes[route]
+            stats.replayed.add(latency_ms)
+            stats.replayed_statuses[str(status)] += 1
+            if entry.latency_ms is not None:
+                stats.recorded.add(float(entry.latency_ms))
+            if entry.status is not None:
+                stats.recorded_statuses[str(entry.status)] += 1
+                if int(entry.status) != status:
+                    stats.status_mismatches += 1
+
+
+class GatewaySender(object):
+    """Sends requests through Chalice's LocalGateway in this process."""
+
+    def __init__(self, gateway):
+        from chalice.local import LocalGatewayException
+
+        self.gateway = gateway
+        self.errors = LocalGatewayException
+
+    def __call__(self, method, path, headers, body):
+        try:
+            response = self.gateway.handle_request(method, path, headers, body)
+        except self.errors as error:
+            return error.CODE
+        return response["statusCode"]
+
+
+class HttpSender(object):
+    """Sends requests to an app that is already running, e.g. chalice local."""
+
+    def __init__(self, target):
+        import requests
+
+        self.target = target.rstrip("/")
+        self.session = requests.Session()
+
+    def __call__(self, method, path, headers, body):
+        response = self.session.request(
+            method, self.target + path, headers=headers, data=body, timeout=60
+        )
+        return response.status_code
+
+
+def replay(entries, send, route_matcher, remap, speed, concurrency):
+    """Send every entry at the recorded pacing divided by speed."""
+    results = Results()
+    slots = threading.BoundedSemaphore(concurrency * 2)
+    first_ts = None
+    started = time.perf_counter()
+    behind = Histogram()
+
+    def run(route, entry, request):
+        try:
+            request_started = time.perf_counter()
+            try:
+                status = send(*request)
+            except Exception:
+                status = 599
+            latency_ms = (time.perf_counter() - request_started) * 1000
+            results.record(route, entry, status, latency_ms)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for entry in entries:
+            path = entry.path.split("?", 1)[0]
+            try:
+                route = route_matcher.match_route(path).route
+            except ValueError:
+                results.unmatched[path] += 1
+                continue
+
+            if speed and entry.ts is not None:
+                if first_ts is None:
+                    first_ts = entry.ts
+                due = started + (entry.ts - first_ts) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # How far the replay lags the recorded schedule
+                    behind.add(-delay * 1000)
+
+            request = remap(entry)
+            # Bounds the entries held in memory while the workers catch up
+            slots.acquire()
+            executor.submit(run, route, entry, request)
+    elapsed = time.perf_counter() - started
+
+    total = sum(stats.replayed.count for stats in results.routes.values())
+    return {
+        "requests": total,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+        "schedule_lag_ms": behind.summary(),
+        "unmatched": dict(results.unmatched.most_common(20)),
+        "routes": {
+            route: stats.summary() for route, stats in sorted(results.routes.items())
+        },
+    }
+
+
+def identity(entry):
+    return entry.method, entry.path, entry.headers, entry.body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log", help="JSONL request log")
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="pacing multiplier, 0 for no pacing"
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--limit", type=int, help="replay at most this many entries")
+    parser.add_argument("--no-remap", action="store_true", help="send as recorded")
+    parser.add_argument("--target", help="url of a running app to replay against")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--leases", type=int, default=100, help="per user")
+    parser.add_argument("--latency", type=float, default=0.02, help="stub seconds")
+    parser.add_argument("--pdf-size", type=int, default=256 * 1024, help="bytes")
+    parser.add_argument("--url", help="database url, defaults to a temporary sqlite")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    dataset = Dataset(args.users, args.leases, logout_users=0)
+    remap = identity if args.no_remap else Remapper(dataset)
+    stub = None
+    queries = None
+
+    if args.target:
+        send = HttpSender(args.target)
+    else:
+        stub = StubBluemoonApi(latency=args.latency, pdf_size=args.pdf_size)
+        stub.start()
+        url = args.url
+        if not url:
+            url = "sqlite:///{}".format(os.path.join(tempfile.mkdtemp(), "replay.db"))
+        configure_environment(api_url=stub.url, database_url=url)
+
+    # Imported once the environment points at the stub and the database
+    from chalice.config import Config
+    from chalice.local import LocalGateway, RouteMatcher
+
+    import app as local_app
+    from chalicelib.database import DatabaseConnection
+    from chalicelib.storage import set_s3_client
+
+    if not args.target:
+        engine = DatabaseConnection().engine()
+        if not args.url:
+            dataset.seed(engine)
+        thread_local_requests(local_app.app)
+        set_s3_client(LocalS3())
+        queries = QueryCounter(engine)
+        send = GatewaySender(LocalGateway(local_app.app, Config()))
+
+    route_matcher = RouteMatcher(list(local_app.app.routes))
+    try:
+        report = replay(
+            read_entries(args.log, limit=args.limit),
+            send=send,
+            route_matcher=route_matcher,
+            remap=remap,
+            speed=args.speed,
+            concurrency=args.concurrency,
+        )
+    finally:
+        if stub is not None:
+            stub.stop()
+    if stub is not None:
+        report["upstream_calls"] = dict(stub.calls)
+    if queries is not None:
+        report["queries"] = queries.count
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
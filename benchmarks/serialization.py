@@ -0,0 +1,89 @@
+"""Per item cost of dumping leases with each serializer.
+
+Compares a new LeaseSchema per dump (the old route behaviour), the shared
+schema instances and the plain dict fast path for pages of 25, 100 and
+1000 leases with two esignatures each.
+
+    python benchmarks/serialization.py
+    python benchmarks/serialization.py --sizes 25 100 --expand
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from chalicelib.models import Lease, LeaseEsignature, StatusEnum, User  # noqa: E402
+from chalicelib.schemas import (  # noqa: E402
+    LeaseExpandedSchema,
+    LeaseSchema,
+    lease_schema,
+    serialize_lease,
+)
+
+
+def build_leases(count):
+    user = User(id=1, username="bench", access_token="")
+    leases = []
+    for number in range(1, count + 1):
+        lease = Lease(id=number, bluemoon_id=number, unit_number=str(number))
+        lease.user = user
+        lease.user_id = user.id
+        for offset in range(2):
+            esignature = LeaseEsignature(
+                id=number * 2 + offset,
+                bluemoon_id=number * 2 + offset,
+                lease_id=number,
+                status=StatusEnum.processing,
+                data={"esign": {"data": {"signers": {"data": []}}}},
+            )
+            lease.esignatures.append(esignature)
+        leases.append(lease)
+    return leases
+
+
+def per_item_us(dump, leases, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        dump(leases)
+    return (time.perf_counter() - started) / repeat / len(leases) * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[25, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--expand", action="store_true", help="full esignatures")
+    args = parser.parse_args()
+
+    schema_class = LeaseExpandedSchema if args.expand else LeaseSchema
+    serializers = [
+        ("new schema", lambda leases: schema_class(many=True).dump(leases)),
+        (
+            "shared schema",
+            lambda leases: lease_schema(expand=args.expand, many=True).dump(leases),
+        ),
+        (
+            "fast path",
+            lambda leases: [
+                serialize_lease(lease, expand=args.expand) for lease in leases
+            ],
+        ),
+    ]
+    print(
+        "{:>6} ".format("items")
+        + " ".join("{:>16}".format(name + " us") for name, _ in serializers)
+    )
+    for size in args.sizes:
+        leases = build_leases(size)
+        timings = [per_item_us(dump, leases, args.repeat) for _, dump in serializers]
+        print(
+            "{:>6} ".format(size)
+            + " ".join("{:>16.1f}".format(timing) for timing in timings)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""Local stand-in for the Bluemoon API with configurable latency and sizes.
+
+Serves the endpoints the app calls: oauth/token, user, property, forms/list,
+the esignature endpoints, lease PDFs and logout. Every call is counted per
+endpoint. Used by load_test.py and replay.py, or on its own:
+
+    python benchmarks/stub_api.py --port 8001 --latency 0.05
+"""
+
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+PROPERTY_NUMBER = 1234
+
+FORMS = [
+    {"type": "standard", "name": "LEASE"},
+    {"type": "standard", "name": "INVENTORY"},
+    {"type": "standard", "name": "POOL"},
+    {"type": "custom", "name": "PARKING"},
+]
+
+
+def signers(completed):
+    """Signers payload, every resident signed when completed is true."""
+    return {
+        "data": [
+            {"identifier": "resident", "completed": completed},
+            {"identifier": "resident", "completed": completed},
+            {"identifier": "owner", "completed": False},
+        ]
+    }
+
+
+def esignature_payload(bluemoon_id, completed=True):
+    return {
+        "id": bluemoon_id,
+        "esign": {"data": {"signers": signers(completed)}},
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    routes = [
+        ("POST", re.compile(r"^/oauth/token$"), "token"),
+        ("GET", re.compile(r"^/api/user$"), "user"),
+        ("GET", re.compile(r"^/api/property$"), "property"),
+        ("GET", re.compile(r"^/api/forms/list/\d+$"), "forms"),
+        ("GET", re.compile(r"^/api/esignature/lease/pdf/\d+$"), "esignature_pdf"),
+        ("GET", re.compile(r"^/api/esignature/lease/(\d+)$"), "esignature"),
+        ("POST", re.compile(r"^/api/esignature/lease$"), "request_esignature"),
+        ("POST", re.compile(r"^/api/esignature/lease/execute/\d+$"), "execute"),
+        ("POST", re.compile(r"^/api/lease/generate/pdf$"), "lease_pdf"),
+        ("POST", re.compile(r"^/api/logout$"), "logout"),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def dispatch(self, method):
+        path = self.path.split("?", 1)[0]
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        for route_method, pattern, name in self.routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                break
+        else:
+            self.server.stub.count("unknown")
+            return self.send_json({"message": "Not Found"}, status=404)
+
+        self.server.stub.count(name)
+        if self.server.stub.latency:
+            time.sleep(self.server.stub.latency)
+        getattr(self, "handle_" + name)(match, body)
+
+    def send_json(self, data, status=200, headers=None):
+        blob = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(blob)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(blob)
+
+    def send_pdf(self):
+        size = self.server.stub.pdf_size
+        chunk = b"%PDF-1.4\n" + b"0" * 65527
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        while size > 0:
+            self.wfile.write(chunk[: min(size, len(chunk))])
+            size -= len(chunk)
+
+    def handle_token(self, match, body):
+        username = json.loads(body.decode("utf-8") or "{}").get("username", "")
+        self.send_json(
+            {
+                "access_token": "token-{}".format(username),
+                "refresh_token": "refresh-{}".format(username),
+                "expires_in": 3600,
+            }
+        )
+
+    def handle_user(self, match, body):
+        self.send_json({"data": {"id": 1, "username": "stub"}})
+
+    def handle_property(self, match, body):
+        self.send_json({"data": [{"id": PROPERTY_NUMBER, "unit_type": "aptdb"}]})
+
+    def handle_forms(self, match, body):
+        etag = '"forms-v1"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_json({"lease": FORMS}, headers={"ETag": etag})
+
+    def handle_esignature(self, match, body):
+        self.send_json({"data": esignature_payload(int(match.group(1)))})
+
+    def handle_request_esignature(self, match, body):
+        bluemoon_id = self.server.stub.next_id()
+        data = esignature_payload(bluemoon_id, completed=False)
+        self.send_json({"success": True, "data": {"id": bluemoon_id, "data": data}})
+
+    def handle_execute(self, match, body):
+        self.send_json({"executed": True})
+
+    def handle_esignature_pdf(self, match, body):
+        self.send_pdf()
+
+    def handle_lease_pdf(self, match, body):
+        self.send_pdf()
+
+    def handle_logout(self, match, body):
+        self.send_json({"success": True})
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 stalls clients that open many connections
+    request_queue_size = 256
+
+
+class StubBluemoonApi(object):
+    """Threaded stub server, start() returns the url to use as API_URL."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, pdf_size=256 * 1024):
+        self.latency = latency
+        self.pdf_size = pdf_size
+        self.calls = Counter()
+        self._ids = itertools.count(10**9)
+        self._lock = threading.Lock()
+        self.server = ThreadingServer((host, port), StubHandler)
+        self.server.stub = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def next_id(self):
+        with self._lock:
+            return next(self._ids)
+
+    def reset(self):
+        with self._lock:
+            self.calls = Counter()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--pdf-size", type=int, default=256 * 1024, help="bytes")
+    args = parser.parse_args()
+
+    stub = StubBluemoonApi(
+        host=args.host, port=args.port, latency=args.latency, pdf_size=args.pdf_size
+    )
+    print("Serving the Bluemoon stub on {}".format(stub.url))
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(stub.calls))
+    finally:
+        stub.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Token lookup latency as the users table grows.
+
+Seeds the users table in steps (1k, 10k, 100k, 1M rows by default) and
+times lookups by the indexed access token digest against the old full
+scan on the access_token text column.
+
+    python benchmarks/token_lookup.py --url mysql+mysqldb://app:secret@db/bench
+    python benchmarks/token_lookup.py --sizes 1000 10000 --lookups 200
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from chalicelib.bluemoon_api import token_digest  # noqa: E402
+from chalicelib.models import Base, User  # noqa: E402
+
+
+def make_token(number):
+    return "token-{:010d}".format(number)
+
+
+def seed(engine, start, stop, chunk_size=10000):
+    """Insert users start..stop with executemany in chunks."""
+    expires = datetime.datetime.now() + datetime.timedelta(days=1)
+    table = User.__table__
+    with engine.begin() as connection:
+        for offset in range(start, stop, chunk_size):
+            rows = []
+            for number in range(offset, min(offset + chunk_size, stop)):
+                token = make_token(number)
+                rows.append(
+                    {
+                        "username": "user{}".format(number),
+                        "access_token": token,
+                        "access_token_digest": token_digest(token),
+                        "expires": expires,
+                    }
+                )
+            connection.execute(table.insert(), rows)
+
+
+def time_lookups(session, column, values):
+    started = time.perf_counter()
+    for value in values:
+        session.query(User.id).filter(column == value).first()
+    return (time.perf_counter() - started) / len(values) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="database url, defaults to a temporary sqlite")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000]
+    )
+    parser.add_argument("--lookups", type=int, default=500)
+    parser.add_argument(
+        "--scan-limit",
+        type=int,
+        default=100000,
+        help="skip the unindexed comparison above this many rows",
+    )
+    args = parser.parse_args()
+
+    url = args.url
+    if not url:
+        url = "sqlite:///{}".format(os.path.join(tempfile.mkdtemp(), "tokens.db"))
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    print("{:>10} {:>14} {:>14}".format("rows", "digest ms", "scan ms"))
+    seeded = 0
+    for size in sorted(args.sizes):
+        seed(engine, seeded, size)
+        seeded = size
+        numbers = [random.randrange(size) for _ in range(args.lookups)]
+        digest_ms = time_lookups(
+            session,
+            User.access_token_digest,
+            [token_digest(make_token(number)) for number in numbers],
+        )
+        scan_ms = "-"
+        if size <= args.scan_limit:
+            # Fewer samples, each of these is a full table scan
+            sample = [make_token(number) for number in numbers[:20]]
+            scan_ms = "{:.3f}".format(time_lookups(session, User.access_token, sample))
+        print("{:>10} {:>14.3f} {:>14}".format(size, digest_ms, scan_ms))
+        session.rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,134 @@
+import collections
 import datetime
-import requests
+import hashlib
 import os
+import time
 
+from chalicelib import concurrency, http_client, instrumentation
+from chalicelib.cache import TTLCache
 from chalicelib.models import User
 from chalicelib.database import DatabaseConnection
+from chalicelib.settings import (
+    FORMS_CATALOG_MAX_AGE,
+    FORMS_CATALOG_SIZE,
+    FORMS_CATALOG_TTL,
+    HTTP_TIMEOUT,
+    PROPERTY_CACHE_SIZE,
+    PROPERTY_CACHE_TTL,
+    TOKEN_CACHE_SIZE,
+    TOKEN_CACHE_TTL,
+)
+
+# Authorized principal as cached by the authorizer, expires is the token expiry
+Principal = collections.namedtuple("Principal", ["id", "expires"])
+
+# Tokens are cached by digest so raw tokens never sit in the cache keys
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL, name="token")
+# Property number per account token, every hit is an upstream call saved
+property_cache = TTLCache(
+    maxsize=PROPERTY_CACHE_SIZE, ttl=PROPERTY_CACHE_TTL, name="property"
+)
+# Lease forms per property number. Catalogs are kept up to the max age so an
+# expired catalog can still be revalidated with its ETag.
+forms_cache = TTLCache(
+    maxsize=FORMS_CATALOG_SIZE, ttl=FORMS_CATALOG_MAX_AGE, name="forms"
+)
+
+
+def token_digest(token):
+    """Fixed length digest of an access token."""
+    return hashlib.sha256((token or "").encode("utf-8")).hexdigest()
+
+
+def cache_stats():
+    """Process wide counters for the caches, the timelines count per request."""
+    return {
+        "token": token_cache.stats(),
+        "property": property_cache.stats(),
+        "forms": forms_cache.stats(),
+    }
+
+
+def response_attrs(response, stream=False):
+    """Status and size of a Bluemoon response for the request timings."""
+    size = response.headers.get("Content-Length")
+    if size is None and not stream:
+        size = len(response.content)
+    return {"status": response.status_code, "bytes": int(size or 0)}
+
+
+def select_property_number(data):
+    """Property number to use from the property endpoint response."""
+    # Accounts can have multiple properties so you need to know
+    # the actual property id, this is just for demonstration purposes
+    # Try to get the aptdb property number
+    for prop in data["data"]:
+        if prop["unit_type"] == "aptdb":
+            return prop["id"]
+    # No apt db then just return the first one
+    return data["data"][0]["id"]
+
+
+class FormsCatalog(object):
+    """Lease forms for a property, indexed by form type for fast lookups."""
+
+    def __init__(self, forms, etag=None):
+        self.forms = forms
+        self.etag = etag
+        self.names = {}
+        for form in forms:
+            self.names.setdefault(form["type"], set()).add(form["name"])
+        self.touch()
+
+    def touch(self):
+        """Mark the catalog as just fetched or revalidated."""
+        self.fetched_at = time.monotonic()
+
+    def is_fresh(self):
+        return time.monotonic() - self.fetched_at < FORMS_CATALOG_TTL
+
+    def classify(self, selected_forms):
+        """Split the selected form names into standard and custom forms."""
+        standard = self.names.get("standard", set())
+        custom = self.names.get("custom", set())
+        return {
+            "standard_forms": [name for name in selected_forms if name in standard],
+            "custom_forms": [name for name in selected_forms if name in custom],
+        }
+
+
+def forms_catalog_headers(catalog):
+    """Headers for the forms/list request, revalidating a cached catalog."""
+    if catalog is not None and catalog.etag:
+        return {"If-None-Match": catalog.etag}
+    return {}
+
+
+def refresh_forms_catalog(property_number, catalog, response):
+    """Catalog from a forms/list response, cached when it lists any forms.
+
+    catalog is the cached one the request revalidated, a 304 keeps it and
+    anything else replaces it.
+    """
+    if response.status_code == 304 and catalog is not None:
+        catalog.touch()
+    else:
+        data = response.json()
+        catalog = FormsCatalog(
+            forms=data.get("lease", []), etag=response.headers.get("ETag")
+        )
+    # An empty list is an api error, let the next request try again
+    if catalog.forms:
+        forms_cache.set(property_number, catalog)
+    return catalog
 
 
 class BluemoonApi(object):
-    def __init__(self, token):
+    def __init__(self, token, url=None, session=None):
+        """url and session default to API_URL and the shared pooled session."""
         self.token = token
-        self.url = os.getenv("API_URL")
+        self.url = url or os.getenv("API_URL")
+        self.session = session or http_client.get_session()
         self.headers = {
             "Accept": "application/json",
             "Authorization": "Bearer {}".format(token),
@@ -28,20 +147,34 @@ class BluemoonApi(object):
         response = self.get_raw(path=path, params=params)
         return response.json()
 
-    def post_raw(self, path, data):
+    def post_raw(self, path, data, stream=False):
         """Used directly for PDFs, via shortcuts for JSON"""
-        headers = self.headers
+        headers = dict(self.headers)
         headers["Content-Type"] = "application/json"
-        response = requests.post(
-            self.generate_url(path), headers=self.headers, json=data
-        )
+        with instrumentation.span("bluemoon", path, method="POST") as span:
+            response = self.session.post(
+                self.generate_url(path),
+                headers=headers,
+                json=data,
+                stream=stream,
+                timeout=HTTP_TIMEOUT,
+            )
+            span.set(**response_attrs(response, stream))
         return response
 
-    def get_raw(self, path, params=None):
+    def get_raw(self, path, params=None, headers=None, stream=False):
         """Used directly for PDFs, via shortcuts for JSON"""
-        response = requests.get(
-            self.generate_url(path), headers=self.headers, params=params
-        )
+        if headers:
+            headers = dict(self.headers, **headers)
+        with instrumentation.span("bluemoon", path, method="GET") as span:
+            response = self.session.get(
+                self.generate_url(path),
+                headers=headers or self.headers,
+                params=params,
+                stream=stream,
+                timeout=HTTP_TIMEOUT,
+            )
+            span.set(**response_attrs(response, stream))
         return response
 
     def user_details(self):
@@ -66,35 +199,65 @@ class BluemoonApi(object):
 
     def lease_forms(self):
         """Fetch all the lease forms for the selected property."""
+        return self.forms_catalog().forms
+
+    def forms_catalog(self):
+        """Cached lease forms catalog for the selected property."""
         property_number = self.property_number()
+        catalog = forms_cache.get(property_number)
+        if catalog is not None and catalog.is_fresh():
+            return catalog
+
         # Filtering by the section, lease as that is all that you can currently
         # access via the Bluemoon Rest API.
         params = {"section": "lease"}
         path = "forms/list/{}".format(property_number)
-        data = self.get_json(path=path, params=params)
-        return data.get("lease", [])
+        response = self.get_raw(
+            path=path, params=params, headers=forms_catalog_headers(catalog)
+        )
+        return refresh_forms_catalog(property_number, catalog, response)
+
+    def prefetch_forms_catalog(self):
+        """Start fetching the forms catalog on the shared pool, returns a future."""
+        return concurrency.submit(self.forms_catalog)
+
+    def invalidate_forms_catalog(self):
+        """Forget the cached forms catalog for this account's property."""
+        forms_cache.delete(self.property_number())
 
     def property_number(self):
         """Fetch a property number associated with an account."""
+        key = token_digest(self.token)
+        property_number = property_cache.get(key)
+        if property_number is not None:
+            return property_number
+
         path = "property"
         data = self.get_json(path=path)
-        # Accounts can have multiple properties so you need to know
-        # the actual property id, this is just for demonstration purposes
-        # Try to get the aptdb property number
-        for prop in data["data"]:
-            if prop["unit_type"] == "aptdb":
-                return prop["id"]
-        # No apt db then just return the first one
-        return data["data"][0]["id"]
+        property_number = select_property_number(data)
+        property_cache.set(key, property_number)
+        return property_number
+
+    def prefetch_property_number(self):
+        """Start fetching the property number on the shared pool, returns a future."""
+        return concurrency.submit(self.property_number)
+
+    def invalidate_property_number(self):
+        """Forget the cached property number for this account."""
+        property_cache.delete(token_digest(self.token))
 
     def logout(self):
         path = "logout"
+        self.invalidate_property_number()
         return self.post_json(path=path, data={})
 
 
 class BluemoonAuthorization(object):
-    def __init__(self):
-        self.url = "{}{}".format(os.getenv("API_URL"), "/oauth/token")
+    def __init__(self, url=None, session=None):
+        """url and session default to API_URL and the shared pooled session."""
+        self.api_url = url or os.getenv("API_URL")
+        self.url = "{}{}".format(self.api_url, "/oauth/token")
+        self.session = session or http_client.get_session()
         self.client_id = os.getenv("OAUTH_CLIENT_ID")
         self.client_secret = os.getenv("OAUTH_CLIENT_SECRET")
         self.db = DatabaseConnection()
@@ -109,7 +272,7 @@ class BluemoonAuthorization(object):
     def user_by_token(self, token):
         session = self.db.session()
         query = session.query(User)
-        user = query.filter(User.access_token == token).first()
+        user = query.filter(User.access_token_digest == token_digest(token)).first()
         return user
 
     def manage_user(self, data, username):
@@ -121,16 +284,23 @@ class BluemoonAuthorization(object):
         user = query.filter(User.username == username).first()
         now = datetime.datetime.now()
         expires = now + datetime.timedelta(seconds=data["expires_in"])
+        # Revoked tokens are blank, keep the digest null so the unique index holds
+        digest = token_digest(data["access_token"]) if data["access_token"] else None
+        if user and user.access_token:
+            # The previous token is replaced, drop it from the authorizer cache
+            token_cache.delete(token_digest(user.access_token))
         if not user:
             user = User(
                 username=username,
                 access_token=data["access_token"],
+                access_token_digest=digest,
                 refresh_token=data["refresh_token"],
                 expires=expires,
             )
             session.add(user)
         else:
             user.access_token = data["access_token"]
+            user.access_token_digest = digest
             user.refresh_token = data["refresh_token"]
             user.expires = expires
         session.commit()
@@ -145,10 +315,11 @@ class BluemoonAuthorization(object):
             "client_secret": self.client_secret,
         }
         # It is important to always pass the accept and content-type json headers for a post
-        response = requests.post(
+        response = self.session.post(
             self.url,
             headers={"Accept": "application/json", "Content-Type": "application/json"},
             json=payload,
+            timeout=HTTP_TIMEOUT,
         )
         data = response.json()
         if response.status_code == 200 and "access_token" in data:
@@ -159,18 +330,31 @@ class BluemoonAuthorization(object):
 
     def check_authorization(self, token):
         # Verifying the token has not expired.
+        now = datetime.datetime.now()
+        key = token_digest(token)
+        principal = token_cache.get(key)
+        if principal is not None:
+            if now < principal.expires:
+                return principal
+            token_cache.delete(key)
+            return False
+
         user = self.user_by_token(token=token)
-        if not user:
+        if not user or not user.expires:
             return False
-        now = datetime.datetime.now()
         if now < user.expires:
-            return user
+            principal = Principal(id=user.id, expires=user.expires)
+            # Never cache past the token expiry
+            ttl = min(TOKEN_CACHE_TTL, (user.expires - now).total_seconds())
+            token_cache.set(key, principal, ttl=ttl)
+            return principal
         return False
 
     def logout(self, token):
-        bm_api = BluemoonApi(token)
+        bm_api = BluemoonApi(token, url=self.api_url, session=self.session)
         # Revoke the token in the API.
         results = bm_api.logout()
+        token_cache.delete(token_digest(token))
         if results["success"]:
             user = self.user_by_token(token)
             # This basicall revokes the token locally
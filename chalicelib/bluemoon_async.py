@@ -0,0 +1,263 @@
+"""Asyncio counterpart of BluemoonApi for batch jobs.
+
+Operational scripts (reconciling esignatures, warming form catalogs,
+refetching documents) make thousands of independent calls. AsyncBluemoonPool
+holds one aiohttp connection pool for all of them, caps the calls in flight
+with a semaphore and spaces calls per host. AsyncBluemoonApi mirrors the
+BluemoonApi calls for one token and shares the property and forms caches
+with it.
+
+    async def refresh(tokens_and_ids):
+        async with AsyncBluemoonPool(concurrency=50, rate=20) as pool:
+            return await asyncio.gather(
+                *(
+                    AsyncBluemoonApi(token, pool=pool).esignature_details(bm_id)
+                    for token, bm_id in tokens_and_ids
+                ),
+                return_exceptions=True,
+            )
+
+    results = run(refresh(tokens_and_ids))
+
+aiohttp is only needed by these scripts, it is not installed for the Lambda.
+"""
+
+import asyncio
+import json
+import os
+import time
+from urllib.parse import urlsplit
+
+from chalicelib.bluemoon_api import (
+    forms_cache,
+    forms_catalog_headers,
+    property_cache,
+    refresh_forms_catalog,
+    select_property_number,
+    token_digest,
+)
+from chalicelib.http_client import RETRY_METHODS, RETRY_STATUSES
+from chalicelib.settings import (
+    ASYNC_CONCURRENCY,
+    ASYNC_POOL_SIZE,
+    ASYNC_RATE,
+    HTTP_BACKOFF_FACTOR,
+    HTTP_RETRIES,
+    HTTP_TIMEOUT,
+)
+
+try:
+    import aiohttp
+except ImportError:
+    # Only the batch scripts need it, see the module docstring
+    aiohttp = None
+
+
+def run(coroutine):
+    """Run a coroutine to completion, asyncio.run for Python 3.6."""
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(coroutine)
+
+
+class HostRateLimiter(object):
+    """Spaces calls to each host out to at most rate per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_call = {}
+
+    async def wait(self, host):
+        if not self.interval:
+            return
+        # No await between reading and reserving the slot, so no lock needed
+        now = time.monotonic()
+        due = max(now, self.next_call.get(host, now))
+        self.next_call[host] = due + self.interval
+        if due > now:
+            await asyncio.sleep(due - now)
+
+
+class RawResponse(object):
+    """Fully read response, the async twin of what get_raw returns."""
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content.decode("utf-8"))
+
+
+class AsyncBluemoonPool(object):
+    """Shared connection pool, concurrency cap and per host rate limit.
+
+    Use it as an async context manager, the aiohttp session is opened on
+    entry and closed on exit.
+    """
+
+    def __init__(
+        self,
+        concurrency=ASYNC_CONCURRENCY,
+        rate=ASYNC_RATE,
+        pool_size=ASYNC_POOL_SIZE,
+        retries=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+    ):
+        if aiohttp is None:
+            raise RuntimeError("AsyncBluemoonPool requires aiohttp")
+        self.concurrency = concurrency
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.limiter = HostRateLimiter(rate)
+        self.semaphore = None
+        self.session = None
+
+    async def __aenter__(self):
+        connect, read = HTTP_TIMEOUT
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(connect=connect, sock_read=read),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+
+    async def request(self, method, url, **kwargs):
+        """Send a request and read the body, retrying idempotent calls.
+
+        Like the sync client only GET, HEAD and OPTIONS are retried, on
+        502, 503 and 504 with exponential backoff.
+        """
+        host = urlsplit(url).netloc
+        attempts = self.retries + 1 if method in RETRY_METHODS else 1
+        for attempt in range(attempts):
+            async with self.semaphore:
+                await self.limiter.wait(host)
+                async with self.session.request(method, url, **kwargs) as response:
+                    content = await response.read()
+            if response.status not in RETRY_STATUSES or attempt == attempts - 1:
+                return RawResponse(response.status, response.headers, content)
+            await asyncio.sleep(self.backoff_factor * (2**attempt))
+
+    async def stream(self, method, url, chunk_size=64 * 1024, **kwargs):
+        """Yield the body in chunks, the call holds its slot until done."""
+        async with self.semaphore:
+            await self.limiter.wait(urlsplit(url).netloc)
+            async with self.session.request(method, url, **kwargs) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    yield chunk
+
+
+class AsyncBluemoonApi(object):
+    def __init__(self, token, pool, url=None):
+        """url defaults to API_URL, pool is an entered AsyncBluemoonPool."""
+        self.token = token
+        self.pool = pool
+        self.url = url or os.getenv("API_URL")
+        self.headers = {
+            "Accept": "application/json",
+            "Authorization": "Bearer {}".format(token),
+        }
+
+    def generate_url(self, path):
+        return "{}/api/{}".format(self.url, path)
+
+    async def post_json(self, path, data):
+        """Shortcut."""
+        response = await self.post_raw(path=path, data=data)
+        return response.json()
+
+    async def get_json(self, path, params=None):
+        """Shortcut."""
+        response = await self.get_raw(path=path, params=params)
+        return response.json()
+
+    async def post_raw(self, path, data):
+        headers = dict(self.headers)
+        headers["Content-Type"] = "application/json"
+        return await self.pool.request(
+            "POST", self.generate_url(path), headers=headers, json=data
+        )
+
+    async def get_raw(self, path, params=None, headers=None):
+        if headers:
+            headers = dict(self.headers, **headers)
+        return await self.pool.request(
+            "GET",
+            self.generate_url(path),
+            headers=headers or self.headers,
+            params=params,
+        )
+
+    def stream_raw(self, path, data=None, chunk_size=64 * 1024):
+        """Async iterator over a document body, POST when data is given."""
+        headers = dict(self.headers)
+        method = "GET"
+        kwargs = {}
+        if data is not None:
+            method = "POST"
+            headers["Content-Type"] = "application/json"
+            kwargs["json"] = data
+        return self.pool.stream(
+            method,
+            self.generate_url(path),
+            chunk_size=chunk_size,
+            headers=headers,
+            **kwargs
+        )
+
+    async def user_details(self):
+        """Currently logged in Bluemoon user."""
+        return await self.get_json(path="user")
+
+    async def execute_lease(self, bm_id, data):
+        """Execute lease for the provided Bluemoon Lease Esignature ID."""
+        path = "esignature/lease/execute/{}".format(bm_id)
+        return await self.post_json(path=path, data=data)
+
+    async def esignature_details(self, bm_id):
+        """Fetch details for the provided Bluemoon Lease Esignature ID."""
+        path = "esignature/lease/{}".format(bm_id)
+        return await self.get_json(path=path)
+
+    def esignature_pdf(self, bm_id, chunk_size=64 * 1024):
+        """Stream the esignature document."""
+        path = "esignature/lease/pdf/{}".format(bm_id)
+        return self.stream_raw(path=path, chunk_size=chunk_size)
+
+    async def lease_forms(self):
+        """Fetch all the lease forms for the selected property."""
+        catalog = await self.forms_catalog()
+        return catalog.forms
+
+    async def forms_catalog(self):
+        """Cached lease forms catalog, shared with BluemoonApi."""
+        property_number = await self.property_number()
+        catalog = forms_cache.get(property_number)
+        if catalog is not None and catalog.is_fresh():
+            return catalog
+
+        params = {"section": "lease"}
+        path = "forms/list/{}".format(property_number)
+        response = await self.get_raw(
+            path=path, params=params, headers=forms_catalog_headers(catalog)
+        )
+        return refresh_forms_catalog(property_number, catalog, response)
+
+    async def property_number(self):
+        """Fetch a property number associated with an account."""
+        key = token_digest(self.token)
+        property_number = property_cache.get(key)
+        if property_number is not None:
+            return property_number
+
+        data = await self.get_json(path="property")
+        property_number = select_property_number(data)
+        property_cache.set(key, property_number)
+        return property_number
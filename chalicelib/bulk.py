@@ -0,0 +1,178 @@
+"""Writes and status derivation for many rows at once.
+
+derive_statuses follows the same owner/signers/signed rules as
+models.derive_status but flattens every signers list into columns first
+and aggregates them in one pass, with NumPy when it is installed.
+"""
+
+from marshmallow import ValidationError
+
+from chalicelib.models import Lease, LeaseEsignature, StatusEnum
+from chalicelib.schemas import LeaseCreateSchema, get_schema
+from chalicelib.settings import BULK_CHUNK_SIZE
+
+try:
+    import numpy
+except ImportError:
+    # numpy is optional, the pure python columns give the same results
+    numpy = None
+
+# Keeps the IN lists of a bulk update at a reasonable size
+UPDATE_CHUNK_SIZE = 1000
+
+
+def signer_columns(signers_payloads):
+    """Flatten signers lists into record, owner and completed columns.
+
+    Lists that are missing or malformed are reported in invalid, exactly
+    where derive_status would raise a KeyError.
+    """
+    records = []
+    owners = []
+    completed = []
+    invalid = set()
+    for index, signers_data in enumerate(signers_payloads):
+        if signers_data is None:
+            invalid.add(index)
+            continue
+        start = len(records)
+        try:
+            for signer in signers_data:
+                owner = signer["identifier"] == "owner"
+                done = bool(signer["completed"])
+                records.append(index)
+                owners.append(owner)
+                completed.append(done)
+        except (KeyError, TypeError):
+            del records[start:], owners[start:], completed[start:]
+            invalid.add(index)
+    return records, owners, completed, invalid
+
+
+def _aggregate_python(count, records, owners, completed):
+    signers = [0] * count
+    signed = [0] * count
+    owner_done = [False] * count
+    for record, owner, done in zip(records, owners, completed):
+        if owner:
+            # The last owner entry wins, as in derive_status
+            owner_done[record] = done
+            continue
+        signers[record] += 1
+        if done:
+            signed[record] += 1
+
+    statuses = []
+    for index in range(count):
+        if owner_done[index]:
+            statuses.append(StatusEnum.executed)
+        elif signers[index] == signed[index]:
+            statuses.append(StatusEnum.signed)
+        elif signers[index]:
+            statuses.append(StatusEnum.processing)
+        else:
+            statuses.append(StatusEnum.pending)
+    return statuses
+
+
+def _aggregate_numpy(count, records, owners, completed):
+    records = numpy.asarray(records, dtype=numpy.int64)
+    owners = numpy.asarray(owners, dtype=bool)
+    completed = numpy.asarray(completed, dtype=bool)
+
+    residents = ~owners
+    signers = numpy.bincount(records[residents], minlength=count)
+    signed = numpy.bincount(records[residents & completed], minlength=count)
+
+    # The last owner entry per record wins, as in derive_status
+    owner_done = numpy.zeros(count, dtype=bool)
+    owner_records = records[owners][::-1]
+    if owner_records.size:
+        unique, last = numpy.unique(owner_records, return_index=True)
+        owner_done[unique] = completed[owners][::-1][last]
+
+    codes = numpy.select(
+        [owner_done, signers == signed, signers > 0],
+        [
+            StatusEnum.executed.value,
+            StatusEnum.signed.value,
+            StatusEnum.processing.value,
+        ],
+        default=StatusEnum.pending.value,
+    )
+    return [StatusEnum(int(code)) for code in codes]
+
+
+def derive_statuses(signers_payloads):
+    """Statuses for many signers lists, None where the list is unusable."""
+    signers_payloads = list(signers_payloads)
+    count = len(signers_payloads)
+    records, owners, completed, invalid = signer_columns(signers_payloads)
+    if numpy is not None and records:
+        statuses = _aggregate_numpy(count, records, owners, completed)
+    else:
+        statuses = _aggregate_python(count, records, owners, completed)
+    for index in invalid:
+        statuses[index] = None
+    return statuses
+
+
+def bulk_update_statuses(session, statuses):
+    """Write {esignature id: status} with one UPDATE per status value.
+
+    None statuses are skipped. Returns the number of rows matched.
+    """
+    ids_by_status = {}
+    for esignature_id, status in statuses.items():
+        if status is not None:
+            ids_by_status.setdefault(status, []).append(esignature_id)
+
+    matched = 0
+    for status, ids in ids_by_status.items():
+        for offset in range(0, len(ids), UPDATE_CHUNK_SIZE):
+            chunk = ids[offset : offset + UPDATE_CHUNK_SIZE]
+            matched += (
+                session.query(LeaseEsignature)
+                .filter(LeaseEsignature.id.in_(chunk))
+                .update({LeaseEsignature.status: status}, synchronize_session=False)
+            )
+    return matched
+
+
+def load_leases(rows):
+    """Validate lease rows, returns the valid rows and errors by row index.
+
+    Errors are keyed by the index as a string so the response stays valid
+    JSON for every encoder.
+    """
+    schema = get_schema(LeaseCreateSchema)
+    valid = []
+    errors = {}
+    for index, row in enumerate(rows):
+        try:
+            valid.append(schema.load(row))
+        except ValidationError as err:
+            errors[str(index)] = err.messages
+    return valid, errors
+
+
+def insert_leases(session, user_id, rows, chunk_size=BULK_CHUNK_SIZE):
+    """Insert loaded lease rows for the user with one executemany per chunk.
+
+    Rows skip the ORM unit of work, nothing is committed here. Returns the
+    number of rows inserted.
+    """
+    table = Lease.__table__
+    inserted = 0
+    for offset in range(0, len(rows), chunk_size):
+        chunk = [
+            {
+                "user_id": user_id,
+                "bluemoon_id": row.get("bluemoon_id"),
+                "unit_number": row.get("unit_number"),
+            }
+            for row in rows[offset : offset + chunk_size]
+        ]
+        session.execute(table.insert(), chunk)
+        inserted += len(chunk)
+    return inserted
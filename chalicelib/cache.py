@@ -0,0 +1,75 @@
+import collections
+import threading
+import time
+
+from chalicelib.instrumentation import count
+
+
+class TTLCache(object):
+    """Thread safe LRU cache whose entries expire after a time to live.
+
+    Lives in process memory, so on Lambda it only spans the invocations
+    handled by a single warm container. A named cache also counts its hits
+    and misses on the request timeline as "<name>_cache.hits" and
+    "<name>_cache.misses".
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, name=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            hit = entry is not None and entry[1] > time.monotonic()
+            if hit:
+                self._data.move_to_end(key)
+                self.hits += 1
+            else:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+        if self.name:
+            count("{}_cache.{}".format(self.name, "hits" if hit else "misses"))
+        return entry[0] if hit else default
+
+    def set(self, key, value, ttl=None):
+        """Store a value, ttl overrides the cache wide time to live."""
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0:
+            self.delete(key)
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Hit and miss counters for monitoring."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,48 @@
+"""Bounded thread pool for upstream calls that do not depend on each other.
+
+Routes submit their Bluemoon calls here and run their database queries on
+the request thread in the meantime, the scoped session is per thread so
+database work must not be submitted. Only request threads should submit,
+a pooled call waiting on another pooled call can starve the pool.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from chalicelib.instrumentation import bind
+from chalicelib.settings import FANOUT_TIMEOUT, FANOUT_WORKERS
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    """Process wide executor, created on first use."""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS)
+    return _executor
+
+
+def submit(func, *args, **kwargs):
+    """Start func on the shared pool, returns a future.
+
+    Spans recorded by func go to the submitting request's timeline.
+    """
+    return get_executor().submit(bind(func), *args, **kwargs)
+
+
+def result(future, timeout=FANOUT_TIMEOUT):
+    """Result of a submitted call, TimeoutError when it takes too long.
+
+    A call that already started keeps running until the http timeouts stop
+    it, its result is dropped.
+    """
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
+
@@ -1,13 +1,99 @@
+import functools
 import os
+import threading
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
 
-from chalicelib.settings import DB_STRING
+from chalicelib.instrumentation import install_engine_events
+from chalicelib.settings import (
+    DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_STRING,
+)
+
+# Engines and session registries are shared by the whole process, keyed by the
+# connection string. Lambda reuses the container between invocations so the
+# pool survives across requests instead of being rebuilt on every call.
+_engines = {}
+_registries = {}
+_lock = threading.RLock()
+
+
+def engine_options(connection_string):
+    """Pool settings for the given connection string."""
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    # SQLite uses a different pool class that does not accept sizing options
+    if make_url(connection_string).get_backend_name() != "sqlite":
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+    return options
+
+
+def get_engine(connection_string):
+    """Process wide engine for the connection string."""
+    engine = _engines.get(connection_string)
+    if engine is None:
+        with _lock:
+            engine = _engines.get(connection_string)
+            if engine is None:
+                engine = create_engine(
+                    connection_string, **engine_options(connection_string)
+                )
+                install_engine_events(engine)
+                _engines[connection_string] = engine
+    return engine
+
+
+def get_session_registry(connection_string):
+    """Thread local session registry bound to the shared engine."""
+    registry = _registries.get(connection_string)
+    if registry is None:
+        with _lock:
+            registry = _registries.get(connection_string)
+            if registry is None:
+                engine = get_engine(connection_string)
+                registry = scoped_session(sessionmaker(bind=engine))
+                _registries[connection_string] = registry
+    return registry
+
+
+def remove_sessions(rollback=False):
+    """Close the current thread's sessions, returning connections to the pool."""
+    for registry in list(_registries.values()):
+        if not registry.registry.has():
+            continue
+        if rollback:
+            registry.rollback()
+        registry.remove()
+
+
+def session_scope(func):
+    """Close (or roll back on error) the request's sessions when the handler ends."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            remove_sessions(rollback=True)
+            raise
+        finally:
+            remove_sessions()
+
+    return wrapper
 
 
 class DatabaseConnection:
     def __init__(self):
-        self.connection_string = DB_STRING.format(
+        # DATABASE_URL points the app at any other database, e.g. benchmarks
+        self.connection_string = os.getenv("DATABASE_URL") or DB_STRING.format(
             user=os.getenv("MYSQL_USER"),
             password=os.getenv("MYSQL_PASSWORD"),
             host=os.getenv("MYSQL_HOST", "db"),
@@ -17,12 +103,22 @@ class DatabaseConnection:
         self.session_obj = None
 
     def engine(self, new=False):
-        if new is False and self.engine_obj is None:
-            self.engine_obj = create_engine(self.connection_string)
+        if new:
+            return create_engine(
+                self.connection_string, **engine_options(self.connection_string)
+            )
+        if self.engine_obj is None:
+            self.engine_obj = get_engine(self.connection_string)
         return self.engine_obj
 
     def session(self, new=False):
-        if new is False and self.session_obj is None:
-            engine = self.engine(new)
-            self.session_obj = sessionmaker(bind=engine)
+        """Request scoped session, pass new to get an independent session."""
+        if new:
+            return sessionmaker(bind=self.engine())()
+        if self.session_obj is None:
+            self.session_obj = get_session_registry(self.connection_string)
         return self.session_obj()
+
+    def remove(self):
+        """Close the current thread's session for this connection."""
+        get_session_registry(self.connection_string).remove()
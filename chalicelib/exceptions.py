@@ -1,2 +1,6 @@
 class MissingLeaseFormsException(Exception):
     pass
+
+
+class InvalidCursorException(Exception):
+    pass
@@ -0,0 +1,66 @@
+import threading
+
+from chalicelib.settings import (
+    HTTP_BACKOFF_FACTOR,
+    HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_MAXSIZE,
+    HTTP_RETRIES,
+)
+
+# Only idempotent requests are retried, a retried POST could create a second
+# esignature request or execute a lease twice.
+RETRY_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+_session = None
+_lock = threading.Lock()
+
+
+def build_session():
+    """Keep-alive session with a connection pool, retries for GETs and no cookies."""
+    # Imported on first use, login and esignature calls pay for it, not startup
+    from http.cookiejar import DefaultCookiePolicy
+
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        method_whitelist=RETRY_METHODS,
+        status_forcelist=RETRY_STATUSES,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    # Every user's client shares this session, a cookie set for one user's
+    # token must never be sent along with another user's request
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session():
+    """Process wide session shared by every Bluemoon client."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def set_session(session):
+    """Swap the shared session, e.g. for one pointed at a local stub server."""
+    global _session
+    with _lock:
+        previous = _session
+        _session = session
+    if previous is not None and previous is not session:
+        previous.close()
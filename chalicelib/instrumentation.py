@@ -0,0 +1,281 @@
+"""Per request timings for database queries, Bluemoon calls and responses.
+
+Routes wrapped with instrument get a timeline for the current thread. The
+database engine, BluemoonApi, the serializers and gzip_response add spans
+to it when one is active and do nothing otherwise, named caches count their
+hits and misses on it. When the route returns, the timeline is summarised in
+a Server-Timing header and handed to the metrics sink, a structured log line by
+default.
+"""
+
+import collections
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+
+from chalice import Response
+from sqlalchemy import event
+
+from chalicelib.settings import INSTRUMENTATION, SERVER_TIMING
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class Span(object):
+    __slots__ = ("category", "name", "duration", "attrs")
+
+    def __init__(self, category, name, duration, attrs):
+        self.category = category
+        self.name = name
+        self.duration = duration
+        self.attrs = attrs
+
+    def as_dict(self):
+        data = {"category": self.category, "ms": round(self.duration * 1000, 3)}
+        if self.name:
+            data["name"] = self.name
+        data.update(self.attrs)
+        return data
+
+
+class Timeline(object):
+    """Spans recorded while handling one request."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.duration = None
+        self.status_code = None
+        self.spans = []
+        self.counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    def add(self, category, duration, name=None, **attrs):
+        # Fan out workers add spans from their own threads
+        with self._lock:
+            self.spans.append(Span(category, name, duration, attrs))
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def finish(self, status_code=None):
+        self.duration = time.perf_counter() - self.started
+        self.status_code = status_code
+
+    def totals(self):
+        """Time and count per category, in the order first seen."""
+        totals = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            total = totals.setdefault(span.category, {"ms": 0.0, "count": 0})
+            total["ms"] += span.duration * 1000
+            total["count"] += 1
+        return totals
+
+    def server_timing(self):
+        """Server-Timing header value, one metric per category plus total."""
+        metrics = []
+        for category, total in self.totals().items():
+            metrics.append(
+                '{};dur={:.1f};desc="n={}"'.format(
+                    category, total["ms"], total["count"]
+                )
+            )
+        if self.duration is not None:
+            metrics.append("total;dur={:.1f}".format(self.duration * 1000))
+        return ", ".join(metrics)
+
+    def as_dict(self):
+        with self._lock:
+            spans = [span.as_dict() for span in self.spans]
+            counters = dict(self.counters)
+        data = {
+            "route": self.name,
+            "status": self.status_code,
+            "ms": round((self.duration or 0) * 1000, 3),
+            "totals": {
+                category: {"ms": round(total["ms"], 3), "count": total["count"]}
+                for category, total in self.totals().items()
+            },
+            "spans": spans,
+        }
+        if counters:
+            data["counters"] = counters
+        return data
+
+
+class MetricsSink(object):
+    """Receives every finished timeline."""
+
+    def emit(self, timeline):
+        raise NotImplementedError
+
+
+class LoggingSink(MetricsSink):
+    """One JSON log line per request."""
+
+    def __init__(self, logger=logger, level=logging.INFO):
+        self.logger = logger
+        self.level = level
+
+    def emit(self, timeline):
+        self.logger.log(self.level, json.dumps(timeline.as_dict()))
+
+
+class InMemorySink(MetricsSink):
+    """Keeps the timelines, for tests and local benchmarks."""
+
+    def __init__(self):
+        self.timelines = []
+        self._lock = threading.Lock()
+
+    def emit(self, timeline):
+        with self._lock:
+            self.timelines.append(timeline)
+
+    def clear(self):
+        with self._lock:
+            self.timelines = []
+
+
+_sink = LoggingSink()
+
+
+def get_sink():
+    return _sink
+
+
+def set_sink(sink):
+    """Swap the metrics sink, returns the previous one."""
+    global _sink
+    previous, _sink = _sink, sink
+    return previous
+
+
+def current():
+    """The timeline of the current thread, None outside instrumented routes."""
+    return getattr(_local, "timeline", None)
+
+
+@contextlib.contextmanager
+def activate(timeline):
+    """Record into timeline on this thread, used by the fan out workers."""
+    previous = current()
+    _local.timeline = timeline
+    try:
+        yield timeline
+    finally:
+        _local.timeline = previous
+
+
+def bind(func):
+    """Wrap func so it records into the current timeline wherever it runs."""
+    timeline = current()
+    if timeline is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with activate(timeline):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def count(name, amount=1):
+    """Add to a counter of the current timeline, if there is one."""
+    timeline = current()
+    if timeline is not None:
+        timeline.count(name, amount)
+
+
+class _SpanRecorder(object):
+    """Yielded by span so callers can attach what they learn along the way."""
+
+    __slots__ = ("attrs",)
+
+    def __init__(self, attrs):
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+@contextlib.contextmanager
+def span(category, name=None, **attrs):
+    """Time the block into the current timeline, if there is one."""
+    recorder = _SpanRecorder(attrs)
+    timeline = current()
+    if timeline is None:
+        yield recorder
+        return
+    started = time.perf_counter()
+    try:
+        yield recorder
+    finally:
+        timeline.add(category, time.perf_counter() - started, name, **recorder.attrs)
+
+
+def instrument(func):
+    """Record a timeline for the route, goes right below @app.route."""
+    if not INSTRUMENTATION:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        timeline = Timeline(func.__name__)
+        response = None
+        try:
+            with activate(timeline):
+                response = func(*args, **kwargs)
+            return response
+        finally:
+            status_code = getattr(response, "status_code", None)
+            if status_code is None:
+                status_code = 200 if response is not None else 500
+            timeline.finish(status_code=status_code)
+            if SERVER_TIMING and isinstance(response, Response):
+                response.headers["Server-Timing"] = timeline.server_timing()
+            try:
+                _sink.emit(timeline)
+            except Exception:
+                logger.exception("Failed to emit request timings")
+
+    return wrapper
+
+
+def install_engine_events(engine):
+    """Record every statement the engine executes as a db span."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        started = conn.info["query_started"].pop()
+        timeline = current()
+        if timeline is not None:
+            verb = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+            attrs = {"many": True} if many else {}
+            # Drivers report -1 for selects, the count only means something for writes
+            if cursor.rowcount >= 0:
+                attrs["rows"] = cursor.rowcount
+            timeline.add("db", time.perf_counter() - started, verb, **attrs)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        stack = (
+            context.connection.info.get("query_started") if context.connection else None
+        )
+        if stack:
+            stack.pop()
+
+    return engine
@@ -1,17 +1,22 @@
+import datetime
 import enum
+import hashlib
+import json
 import logging
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import backref, deferred, relationship
 from sqlalchemy import (
     Boolean,
     Column,
     DateTime,
     Enum,
     ForeignKey,
+    Index,
     Integer,
     JSON,
     String,
     Text,
+    UniqueConstraint,
 )
 
 Base = declarative_base()
@@ -24,15 +29,67 @@ class StatusEnum(enum.Enum):
     executed = 4
 
 
+# Bluemoon can still change these, the reconciler keeps them up to date. A
+# signed lease changes again once the owner executes it.
+OPEN_STATUSES = (StatusEnum.pending, StatusEnum.processing, StatusEnum.signed)
+# Only an executed document can no longer change
+DOCUMENT_FINAL_STATUSES = (StatusEnum.executed,)
+
+
+def payload_digest(data):
+    """Stable digest of a Bluemoon payload, key order does not matter."""
+    blob = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def signers_from_payload(data):
+    """Signers list of a Bluemoon esignature payload, KeyError if missing."""
+    # The data is a bit nested, but ideally Bluemoon API will pass a document status soon
+    return data["esign"]["data"]["signers"]["data"]
+
+
+def derive_status(signers_data):
+    """Determine status of esignatures based on signers data."""
+    # As this is Bluemoon logic and there are other possible
+    # statuses such as expired. A ticket has been created to
+    # include the status on the object
+    signers = 0
+    signed = 0
+    owner = False
+    for signer in signers_data:
+        if signer["identifier"] == "owner":
+            owner = signer["completed"]
+            continue
+
+        signers += 1
+        if signer["completed"]:
+            signed += 1
+
+    if owner:
+        return StatusEnum.executed
+    elif signers == signed:
+        return StatusEnum.signed
+    elif signers:
+        return StatusEnum.processing
+    else:
+        return StatusEnum.pending
+
+
 class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True)
     username = Column(String(80), nullable=False)
     access_token = Column(Text, nullable=False)
+    # sha256 of the access token, the indexed column used for token lookups
+    access_token_digest = Column(String(64))
     refresh_token = Column(Text)
     expires = Column(DateTime)
 
+    __table_args__ = (
+        UniqueConstraint("access_token_digest", name="uq_users_access_token_digest"),
+    )
+
     def __repr__(self):
         return "<User %r>" % self.username
 
@@ -46,6 +103,13 @@ class Lease(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     user = relationship("User", backref=backref("leases", lazy=True))
 
+    # Lists are always scoped to the user, these follow the ModelFilter fields
+    __table_args__ = (
+        Index("ix_leases_user_id_id", "user_id", "id"),
+        Index("ix_leases_user_id_unit_number", "user_id", "unit_number"),
+        Index("ix_leases_user_id_bluemoon_id", "user_id", "bluemoon_id"),
+    )
+
     def __repr__(self):
         return "<Lease %r>" % self.unit_number
 
@@ -56,35 +120,76 @@ class LeaseEsignature(Base):
     id = Column(Integer, primary_key=True)
     bluemoon_id = Column(Integer)
     status = Column(Enum(StatusEnum), default=StatusEnum.pending)
-    data = Column(JSON)
+    # The full Bluemoon payload, only loaded when accessed or undeferred
+    data = deferred(Column(JSON))
+    # payload_digest of data, lets repeated payloads skip the write
+    data_digest = Column(String(64))
+    # Last time the payload was confirmed against Bluemoon
+    refreshed_at = Column(DateTime)
+    # S3 key of the stored document, see document_cache_key
+    document_key = Column(String(255))
     lease_id = Column(Integer, ForeignKey("leases.id"), nullable=False)
     lease = relationship("Lease", backref=backref("esignatures", lazy=True))
 
+    __table_args__ = (
+        # Notifications look esignatures up by the Bluemoon id
+        Index("ix_lease_esignatures_bluemoon_id", "bluemoon_id"),
+        Index("ix_lease_esignatures_lease_id_id", "lease_id", "id"),
+        # The reconciler picks the least recently refreshed open esignatures
+        Index("ix_lease_esignatures_status_refreshed_at", "status", "refreshed_at"),
+    )
+
     def __repr__(self):
         return "<LeaseEsignature %r>" % self.id
 
+    def document_cache_key(self):
+        """S3 key for the document at its current status.
+
+        None until the lease is executed, the document changes with every
+        signature but the status does not always follow.
+        """
+        if self.status not in DOCUMENT_FINAL_STATUSES:
+            return None
+        return "esignatures/{}/{}.pdf".format(self.bluemoon_id, self.status.name)
+
+    def cached_document_key(self):
+        """Stored S3 key if it still matches the current document."""
+        key = self.document_cache_key()
+        if key and self.document_key == key:
+            return key
+        return None
+
+    def apply_payload(self, data, digest=None):
+        """Store a Bluemoon esignature payload and derive the status from it.
+
+        Returns False without touching the record when the payload matches
+        the stored one.
+        """
+        if digest is None:
+            digest = payload_digest(data)
+        if self.data_digest == digest:
+            return False
+
+        self.data = data
+        self.data_digest = digest
+        self.refreshed_at = datetime.datetime.now()
+        try:
+            self.transition_status(signers_data=signers_from_payload(data))
+        except KeyError:
+            pass
+        return True
+
+    def mark_refreshed(self):
+        """The stored payload was just confirmed to be current."""
+        self.refreshed_at = datetime.datetime.now()
+
+    def is_stale(self, max_age):
+        """Whether the payload is older than max_age seconds."""
+        if self.refreshed_at is None:
+            return True
+        age = datetime.datetime.now() - self.refreshed_at
+        return age.total_seconds() > max_age
+
     def transition_status(self, signers_data):
         """Determine status of esignatures based on signers data."""
-        # As this is Bluemoon logic and there are other possible
-        # statuses such as expired. A ticket has been created to
-        # include the status on the object
-        signers = 0
-        signed = 0
-        owner = False
-        for signer in signers_data:
-            if signer["identifier"] == "owner":
-                owner = signer["completed"]
-                continue
-
-            signers += 1
-            if signer["completed"]:
-                signed += 1
-
-        if owner:
-            self.status = StatusEnum.executed
-        elif signers == signed:
-            self.status = StatusEnum.signed
-        elif signers:
-            self.status = StatusEnum.processing
-        else:
-            self.status = StatusEnum.pending
+        self.status = derive_status(signers_data)
@@ -0,0 +1,135 @@
+import logging
+import threading
+
+from chalicelib.cache import TTLCache
+from chalicelib.database import DatabaseConnection
+from chalicelib.models import LeaseEsignature, payload_digest
+from chalicelib.settings import (
+    NOTIFICATIONS_BATCH_SIZE,
+    NOTIFICATIONS_DEDUP_SIZE,
+    NOTIFICATIONS_DEDUP_TTL,
+    NOTIFICATIONS_FLUSH_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+# Digest of the last payload applied per Bluemoon id, repeats of it are
+# acknowledged without touching the database
+recent_payloads = TTLCache(
+    maxsize=NOTIFICATIONS_DEDUP_SIZE, ttl=NOTIFICATIONS_DEDUP_TTL
+)
+
+
+def notification_id(data):
+    """Bluemoon id of a notification as an int, ValueError if it isn't one."""
+    try:
+        return int(data["id"])
+    except (TypeError, ValueError):
+        raise ValueError("Invalid esignature id {!r}".format(data["id"]))
+
+
+def is_duplicate(data):
+    return recent_payloads.get(notification_id(data)) == payload_digest(data)
+
+
+def apply_notifications(session, payloads):
+    """Apply the latest payload per Bluemoon id with one select and one commit.
+
+    payloads is keyed by notification_id. Returns the Bluemoon ids that have
+    no matching esignature.
+    """
+    if not payloads:
+        return set()
+    query = session.query(LeaseEsignature)
+    esignatures = query.filter(LeaseEsignature.bluemoon_id.in_(list(payloads))).all()
+
+    changed = False
+    applied = []
+    for lease_esignature in esignatures:
+        data = payloads[lease_esignature.bluemoon_id]
+        digest = payload_digest(data)
+        if lease_esignature.apply_payload(data, digest=digest):
+            session.add(lease_esignature)
+            changed = True
+        applied.append((lease_esignature.bluemoon_id, digest))
+    if changed:
+        session.commit()
+    # Only remembered once stored, a failed commit has to be retried by
+    # Bluemoon rather than acknowledged as a duplicate
+    for bluemoon_id, digest in applied:
+        recent_payloads.set(bluemoon_id, digest)
+    return set(payloads) - set(esignature.bluemoon_id for esignature in esignatures)
+
+
+class NotificationBuffer(object):
+    """Coalesces notifications per esignature and applies them in batches.
+
+    Each payload is the full esignature state so only the latest one per
+    Bluemoon id is kept. The buffer flushes once it holds batch_size
+    esignatures or after flush_interval seconds, whichever comes first.
+    Pending payloads only live in memory, use it where the process outlives
+    the request (chalice local, containers) rather than on Lambda.
+    """
+
+    def __init__(
+        self,
+        batch_size=NOTIFICATIONS_BATCH_SIZE,
+        flush_interval=NOTIFICATIONS_FLUSH_INTERVAL,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    def add(self, data):
+        bluemoon_id = notification_id(data)
+        with self._lock:
+            self.pending[bluemoon_id] = data
+            full = len(self.pending) >= self.batch_size
+            if not full:
+                self._schedule()
+        if full:
+            self.flush()
+
+    def _schedule(self):
+        """Start the flush timer unless one is running, hold _lock."""
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Apply everything pending in a single transaction."""
+        with self._lock:
+            payloads, self.pending = self.pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not payloads:
+            return set()
+
+        # Flushes can run on the timer thread, use a session of our own
+        with self._flush_lock:
+            session = DatabaseConnection().session(new=True)
+            try:
+                unknown = apply_notifications(session, payloads)
+            except Exception:
+                session.rollback()
+                # Keep them for the next flush unless a newer payload arrived,
+                # the timer retries even if no other notification comes in
+                with self._lock:
+                    for bluemoon_id, data in payloads.items():
+                        self.pending.setdefault(bluemoon_id, data)
+                    self._schedule()
+                logger.exception("Failed to apply %d notifications", len(payloads))
+                raise
+            finally:
+                session.close()
+        if unknown:
+            logger.warning("Notifications for unknown esignatures: %s", sorted(unknown))
+        return unknown
+
+
+notification_buffer = NotificationBuffer()
@@ -0,0 +1,286 @@
+"""Refreshes open esignatures from Bluemoon in the background.
+
+Runs as a Chalice scheduled function (see app.py) or from the command line:
+
+    python -m chalicelib.reconciler --limit 1000 --concurrency 8 --rate 10
+    python -m chalicelib.reconciler --limit 20000 --concurrency 200 --rate 50 --async
+
+--backfill recomputes every stored status from its saved payload instead,
+without calling Bluemoon.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from chalicelib.bluemoon_api import BluemoonApi
+from chalicelib.database import DatabaseConnection
+from chalicelib.models import (
+    OPEN_STATUSES,
+    Lease,
+    LeaseEsignature,
+    User,
+    signers_from_payload,
+)
+from chalicelib.settings import (
+    RECONCILE_BATCH_SIZE,
+    RECONCILE_COMMIT_SIZE,
+    RECONCILE_CONCURRENCY,
+    RECONCILE_MIN_AGE,
+    RECONCILE_RATE,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter(object):
+    """Spaces calls out to at most rate per second across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_call = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def stale_esignatures(session, min_age, limit):
+    """(id, bluemoon_id, access_token) of the open esignatures not refreshed
+    within min_age seconds, oldest first, with the token of a user that can
+    still call Bluemoon."""
+    now = datetime.datetime.now()
+    cutoff = now - datetime.timedelta(seconds=min_age)
+    query = (
+        session.query(
+            LeaseEsignature.id, LeaseEsignature.bluemoon_id, User.access_token
+        )
+        .join(Lease, LeaseEsignature.lease_id == Lease.id)
+        .join(User, Lease.user_id == User.id)
+        .filter(LeaseEsignature.status.in_(OPEN_STATUSES))
+        .filter(
+            (LeaseEsignature.refreshed_at == None)  # noqa
+            | (LeaseEsignature.refreshed_at < cutoff)
+        )
+        .filter(User.expires > now)
+        .order_by(LeaseEsignature.refreshed_at, LeaseEsignature.id)
+    )
+    return query.limit(limit).all()
+
+
+def fetch_details(bluemoon_id, token, limiter):
+    limiter.wait()
+    return BluemoonApi(token=token).esignature_details(bm_id=bluemoon_id)
+
+
+def fetch_threaded(rows, concurrency, rate):
+    """(row, details or exception) pairs as the thread pool finishes."""
+    limiter = RateLimiter(rate)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(
+                fetch_details, row.bluemoon_id, row.access_token, limiter
+            ): row
+            for row in rows
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as error:
+                yield futures[future], error
+
+
+def fetch_async(rows, concurrency, rate):
+    """(row, details or exception) pairs from the asyncio client."""
+    # app imports this module, keep asyncio off the Lambda's import path
+    import asyncio
+
+    from chalicelib.bluemoon_async import AsyncBluemoonApi, AsyncBluemoonPool, run
+
+    async def fetch_all():
+        async with AsyncBluemoonPool(concurrency=concurrency, rate=rate) as pool:
+            return await asyncio.gather(
+                *(
+                    AsyncBluemoonApi(row.access_token, pool=pool).esignature_details(
+                        row.bluemoon_id
+                    )
+                    for row in rows
+                ),
+                return_exceptions=True
+            )
+
+    responses = run(fetch_all())
+    return zip(rows, responses)
+
+
+def store_details(session, details, results):
+    """Apply fetched payloads, keyed by esignature id, in one transaction."""
+    esignatures = (
+        session.query(LeaseEsignature)
+        .filter(LeaseEsignature.id.in_(list(details)))
+        .all()
+    )
+    for lease_esignature in esignatures:
+        if lease_esignature.apply_payload(details[lease_esignature.id]):
+            results["updated"] += 1
+        lease_esignature.mark_refreshed()
+        session.add(lease_esignature)
+    session.commit()
+
+
+def reconcile(
+    session=None,
+    limit=RECONCILE_BATCH_SIZE,
+    concurrency=RECONCILE_CONCURRENCY,
+    rate=RECONCILE_RATE,
+    min_age=RECONCILE_MIN_AGE,
+    use_async=False,
+    commit_size=RECONCILE_COMMIT_SIZE,
+):
+    """Fetch the stale open esignatures and store what changed.
+
+    Bluemoon calls run on a bounded thread pool, or the asyncio client with
+    use_async, behind a shared rate limit. All database work stays on the
+    calling thread and no transaction is open while calls are in flight,
+    results are stored commit_size at a time as they arrive. Returns
+    counters.
+    """
+    if session is None:
+        session = DatabaseConnection().session()
+    rows = stale_esignatures(session, min_age=min_age, limit=limit)
+    # End the read transaction before calling Bluemoon
+    session.commit()
+    results = {"checked": len(rows), "updated": 0, "errors": 0}
+    if not rows:
+        return results
+
+    fetch = fetch_async if use_async else fetch_threaded
+    details = {}
+    for row, response in fetch(rows, concurrency, rate):
+        if isinstance(response, Exception):
+            logger.error("Failed to refresh %r", row, exc_info=response)
+            results["errors"] += 1
+            continue
+        if not response or "data" not in response:
+            results["errors"] += 1
+            continue
+        details[row.id] = response["data"]
+        if len(details) >= commit_size:
+            store_details(session, details, results)
+            details = {}
+    if details:
+        store_details(session, details, results)
+    return results
+
+
+def backfill_statuses(session=None, batch_size=RECONCILE_BATCH_SIZE):
+    """Recompute stored statuses from the saved payloads in batches.
+
+    Each batch derives its statuses together and writes the changed ones
+    with one UPDATE per status value. Returns counters.
+    """
+    # Only needed here, keeps numpy out of the request path
+    from chalicelib.bulk import bulk_update_statuses, derive_statuses
+
+    if session is None:
+        session = DatabaseConnection().session()
+    results = {"checked": 0, "updated": 0}
+    last_id = 0
+    while True:
+        rows = (
+            session.query(
+                LeaseEsignature.id, LeaseEsignature.status, LeaseEsignature.data
+            )
+            .filter(LeaseEsignature.id > last_id)
+            .order_by(LeaseEsignature.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        signers_payloads = []
+        for row in rows:
+            try:
+                signers_payloads.append(signers_from_payload(row.data))
+            except (KeyError, TypeError):
+                signers_payloads.append(None)
+        statuses = derive_statuses(signers_payloads)
+
+        changed = {
+            row.id: status
+            for row, status in zip(rows, statuses)
+            if status is not None and status != row.status
+        }
+        results["checked"] += len(rows)
+        results["updated"] += bulk_update_statuses(session, changed)
+        session.commit()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh open esignatures.")
+    parser.add_argument("--limit", type=int, default=RECONCILE_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=RECONCILE_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=RECONCILE_RATE)
+    parser.add_argument("--min-age", type=int, default=RECONCILE_MIN_AGE)
+    parser.add_argument(
+        "--every", type=int, help="keep running, reconciling every N seconds"
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="fetch with the asyncio client, requires aiohttp",
+    )
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="recompute stored statuses from saved payloads and exit",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.backfill:
+        db = DatabaseConnection()
+        try:
+            print(
+                json.dumps(
+                    backfill_statuses(session=db.session(), batch_size=args.limit)
+                )
+            )
+        finally:
+            db.remove()
+        return
+
+    while True:
+        db = DatabaseConnection()
+        try:
+            results = reconcile(
+                session=db.session(),
+                limit=args.limit,
+                concurrency=args.concurrency,
+                rate=args.rate,
+                min_age=args.min_age,
+                use_async=args.use_async,
+            )
+        finally:
+            db.remove()
+        print(json.dumps(results))
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,13 @@
-from marshmallow import Schema, fields, validate
+import threading
+from marshmallow import EXCLUDE, Schema, fields, validate
 from marshmallow_sqlalchemy import ModelSchema
 
+from chalicelib.instrumentation import span
 from chalicelib.models import Lease, LeaseEsignature, StatusEnum, User
+from chalicelib.settings import FAST_SERIALIZERS
+
+_schemas = {}
+_lock = threading.Lock()
 
 
 class SmartNested(fields.Nested):
@@ -11,14 +17,32 @@ class SmartNested(fields.Nested):
         return super(SmartNested, self).serialize(attr, obj, accessor)
 
 
+class LeaseEsignatureSummarySchema(Schema):
+    """Compact esignature without the Bluemoon payload, used in lease lists."""
+
+    id = fields.Integer()
+    bluemoon_id = fields.Integer()
+    status = fields.Method("get_status")
+    lease_id = fields.Integer()
+
+    def get_status(self, obj):
+        return obj.status.name
+
+
 class LeaseSchema(ModelSchema):
-    esignatures = fields.Nested("LeaseEsignatureSchema", many=True, exclude=("lease",))
+    esignatures = fields.Nested(LeaseEsignatureSummarySchema, many=True, dump_only=True)
 
     class Meta:
         model = Lease
         exclude = ("user_id",)
 
 
+class LeaseExpandedSchema(LeaseSchema):
+    """Lease with the full esignature payloads, requested with expand."""
+
+    esignatures = fields.Nested("LeaseEsignatureSchema", many=True, exclude=("lease",))
+
+
 class LeaseEsignatureSchema(ModelSchema):
     status = fields.Method("get_status", deserialize="load_status")
 
@@ -33,6 +57,19 @@ class LeaseEsignatureSchema(ModelSchema):
 
     class Meta:
         model = LeaseEsignature
+        # Internal bookkeeping, serialize_esignature has to match this output
+        exclude = ("document_key", "data_digest", "refreshed_at")
+
+
+class LeaseCreateSchema(Schema):
+    """Lease row for bulk creation, loads plain dicts instead of models."""
+
+    bluemoon_id = fields.Integer(allow_none=True)
+    unit_number = fields.Str(allow_none=True, validate=validate.Length(max=15))
+
+    class Meta:
+        # Exports often carry ids and other columns, only these are used
+        unknown = EXCLUDE
 
 
 class UserSchema(ModelSchema):
@@ -49,6 +86,8 @@ class PaginatedLeaseSchema(Schema):
     has_next = fields.Boolean()
     total = fields.Integer()
     pages = fields.Integer()
+    # Only present on keyset pages, pass it back as the cursor parameter
+    next_cursor = fields.String()
 
 
 class LoginSchema(Schema):
@@ -72,3 +111,99 @@ class ExecuteSchema(Schema):
 
 class PrintPdfSchema(Schema):
     forms = fields.List(fields.Str())
+
+
+def get_schema(schema_class, **options):
+    """Shared schema instance for dumping and session-less loads.
+
+    ModelSchema introspects the model on construction so instances are built
+    once per class and options. Dumping does not mutate the schema which makes
+    the instances safe to share between threads. ModelSchema.load(session=...)
+    stores the session on the instance, those loads need their own instance.
+    """
+    key = (schema_class, tuple(sorted(options.items())))
+    schema = _schemas.get(key)
+    if schema is None:
+        with _lock:
+            schema = _schemas.get(key)
+            if schema is None:
+                schema = schema_class(**options)
+                _schemas[key] = schema
+    return schema
+
+
+def lease_projection(params):
+    """Lease fields and expansion requested through the query parameters.
+
+    fields is a comma separated list of lease fields to return, expand=esignatures
+    includes the full esignature payloads instead of the summary.
+    """
+    params = params or {}
+    only = None
+    if params.get("fields"):
+        requested = [name.strip() for name in params["fields"].split(",")]
+        only = tuple(name for name in requested if name in LeaseSchema._declared_fields)
+    expand = "esignatures" in (params.get("expand") or "").split(",")
+    return only or None, expand
+
+
+def lease_schema(only=None, expand=False, many=False):
+    """Lease schema for the requested projection."""
+    schema_class = LeaseExpandedSchema if expand else LeaseSchema
+    return get_schema(schema_class, only=only, many=many)
+
+
+def serialize_esignature(esignature, summary=True):
+    """Plain dict matching LeaseEsignatureSummarySchema or the nested
+    LeaseEsignatureSchema output."""
+    data = {
+        "id": esignature.id,
+        "bluemoon_id": esignature.bluemoon_id,
+        "status": esignature.status.name,
+    }
+    if summary:
+        data["lease_id"] = esignature.lease_id
+    else:
+        data["data"] = esignature.data
+    return data
+
+
+def serialize_lease(lease, only=None, expand=False):
+    """Plain dict matching the LeaseSchema and LeaseExpandedSchema output."""
+    data = {
+        "id": lease.id,
+        "bluemoon_id": lease.bluemoon_id,
+        "unit_number": lease.unit_number,
+        "user": lease.user_id,
+    }
+    if only is None or "esignatures" in only:
+        data["esignatures"] = [
+            serialize_esignature(esignature, summary=not expand)
+            for esignature in lease.esignatures
+        ]
+    if only is not None:
+        data = {name: data[name] for name in only if name in data}
+    return data
+
+
+def dump_lease(lease, only=None, expand=False):
+    """Serialize a lease with the requested projection."""
+    with span("dump", "lease"):
+        if FAST_SERIALIZERS:
+            return serialize_lease(lease, only=only, expand=expand)
+        return lease_schema(only=only, expand=expand).dump(lease)
+
+
+def dump_lease_page(page, only=None, expand=False):
+    """Serialize a page of leases with the requested projection."""
+    with span("dump", "lease_page", items=len(page.items)):
+        data = get_schema(PaginatedLeaseSchema, exclude=("items",)).dump(page)
+        if FAST_SERIALIZERS:
+            data["items"] = [
+                serialize_lease(lease, only=only, expand=expand) for lease in page.items
+            ]
+        else:
+            data["items"] = lease_schema(only=only, expand=expand, many=True).dump(
+                page.items
+            )
+    return data
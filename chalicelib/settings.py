@@ -3,3 +3,95 @@ import os
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 DB_STRING = "mysql+mysqldb://{user}:{password}@{host}/{database}"
 DEBUG = True
+
+# Database connection pool, shared by every request handled by the process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+# MySQL drops idle connections after wait_timeout, recycle well before that
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 3600))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+# Authorizer token cache, entries never outlive the token expiry
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 4096))
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", 300))
+
+# Bluemoon API http client, timeouts are in seconds (connect, read)
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", 4))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 10))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", 0.3))
+HTTP_TIMEOUT = (
+    float(os.getenv("HTTP_CONNECT_TIMEOUT", 3.05)),
+    float(os.getenv("HTTP_READ_TIMEOUT", 30)),
+)
+
+# Property number per account, it rarely changes so it can live for a while
+PROPERTY_CACHE_SIZE = int(os.getenv("PROPERTY_CACHE_SIZE", 1024))
+PROPERTY_CACHE_TTL = int(os.getenv("PROPERTY_CACHE_TTL", 900))
+
+# Lease forms catalog per property, revalidated with its ETag once stale
+FORMS_CATALOG_SIZE = int(os.getenv("FORMS_CATALOG_SIZE", 256))
+FORMS_CATALOG_TTL = int(os.getenv("FORMS_CATALOG_TTL", 300))
+FORMS_CATALOG_MAX_AGE = int(os.getenv("FORMS_CATALOG_MAX_AGE", 86400))
+
+# Streaming document uploads to S3, parts must be at least 5MB except the last
+S3_CHUNK_SIZE = int(os.getenv("S3_CHUNK_SIZE", 64 * 1024))
+S3_PART_SIZE = max(int(os.getenv("S3_PART_SIZE", 8 * 1024 * 1024)), 5 * 1024 * 1024)
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", 4))
+S3_URL_EXPIRES = int(os.getenv("S3_URL_EXPIRES", 3600))
+
+# Cached list totals, writes invalidate them within the process and the ttl
+# bounds how stale another process' count can be
+TOTAL_CACHE_SIZE = int(os.getenv("TOTAL_CACHE_SIZE", 4096))
+TOTAL_CACHE_TTL = int(os.getenv("TOTAL_CACHE_TTL", 60))
+
+# Build lease responses as plain dicts instead of going through marshmallow
+FAST_SERIALIZERS = os.getenv("FAST_SERIALIZERS", "1") == "1"
+
+# Response compression, bodies under the minimum size are sent as is
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", 1024))
+
+# Bluemoon esignature notifications. sync applies each webhook in the request,
+# queued coalesces them per esignature and flushes in batches.
+NOTIFICATIONS_MODE = os.getenv("NOTIFICATIONS_MODE", "sync")
+NOTIFICATIONS_BATCH_SIZE = int(os.getenv("NOTIFICATIONS_BATCH_SIZE", 50))
+NOTIFICATIONS_FLUSH_INTERVAL = float(os.getenv("NOTIFICATIONS_FLUSH_INTERVAL", 1))
+NOTIFICATIONS_DEDUP_SIZE = int(os.getenv("NOTIFICATIONS_DEDUP_SIZE", 4096))
+NOTIFICATIONS_DEDUP_TTL = int(os.getenv("NOTIFICATIONS_DEDUP_TTL", 600))
+
+# Esignature reconciler. Open esignatures not refreshed for RECONCILE_MIN_AGE
+# seconds are fetched again, at most RECONCILE_RATE calls per second.
+# lease_execute only fetches live when the record is older than the threshold.
+RECONCILE_SCHEDULE_MINUTES = int(os.getenv("RECONCILE_SCHEDULE_MINUTES", 5))
+RECONCILE_MIN_AGE = int(os.getenv("RECONCILE_MIN_AGE", 120))
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", 500))
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", 8))
+RECONCILE_RATE = float(os.getenv("RECONCILE_RATE", 10))
+# Results are stored and committed this many at a time, a run that times out
+# keeps what it already stored
+RECONCILE_COMMIT_SIZE = int(os.getenv("RECONCILE_COMMIT_SIZE", 50))
+# Rows per scheduled run, at RECONCILE_RATE this is 30s of calls which fits the
+# reconcile_esignatures lambda_timeout in .chalice/config.json
+RECONCILE_SCHEDULE_LIMIT = int(os.getenv("RECONCILE_SCHEDULE_LIMIT", 300))
+ESIGNATURE_STALE_SECONDS = int(os.getenv("ESIGNATURE_STALE_SECONDS", 600))
+
+# POST /leases/bulk, rows per insert statement and per request
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", 500))
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", 10000))
+
+# Thread pool for independent Bluemoon calls made while a route queries the
+# database, the timeout in seconds bounds how long a route waits on them
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", 8))
+FANOUT_TIMEOUT = float(os.getenv("FANOUT_TIMEOUT", 35))
+
+# Request timings, logged per request and summarised in a Server-Timing header
+INSTRUMENTATION = os.getenv("INSTRUMENTATION", "1") == "1"
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"
+
+# Asyncio Bluemoon client for batch scripts, rate is calls per second per host
+# and 0 disables the limit
+ASYNC_CONCURRENCY = int(os.getenv("ASYNC_CONCURRENCY", 50))
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_POOL_SIZE", 100))
+ASYNC_RATE = float(os.getenv("ASYNC_RATE", 0))
@@ -0,0 +1,149 @@
+import datetime
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from chalicelib.settings import (
+    S3_CHUNK_SIZE,
+    S3_MAX_CONCURRENCY,
+    S3_PART_SIZE,
+    S3_URL_EXPIRES,
+)
+
+_s3_client = None
+_lock = threading.Lock()
+
+
+def get_s3_client():
+    """Process wide S3 client, boto3 is only imported by the first caller."""
+    global _s3_client
+    if _s3_client is None:
+        with _lock:
+            if _s3_client is None:
+                # boto3 is slow to import and most routes never touch S3
+                import boto3
+
+                _s3_client = boto3.client(
+                    "s3", endpoint_url=os.getenv("AWS_S3_ENDPOINT_URL") or None
+                )
+    return _s3_client
+
+
+def set_s3_client(s3_client):
+    """Swap the shared client, e.g. for a local stand-in."""
+    global _s3_client
+    with _lock:
+        _s3_client = s3_client
+
+
+def pdf_key():
+    """Random day/month prefixed key for a generated document."""
+    now = datetime.datetime.now()
+    return "{0:%d}/{0:%m}/{1}.pdf".format(now, uuid.uuid4().hex)
+
+
+def presigned_url(s3_client, bucket, key, expires_in=S3_URL_EXPIRES):
+    return s3_client.generate_presigned_url(
+        ClientMethod="get_object",
+        Params={"Bucket": bucket, "Key": key},
+        ExpiresIn=expires_in,
+    )
+
+
+def upload_stream(
+    chunks,
+    s3_client,
+    bucket,
+    key,
+    content_type="application/pdf",
+    part_size=S3_PART_SIZE,
+    max_concurrency=S3_MAX_CONCURRENCY,
+):
+    """Pipe an iterable of byte chunks into S3 as they arrive.
+
+    Parts are uploaded while the rest of the stream is still downloading.
+    At most max_concurrency parts are in flight plus the one being filled,
+    so memory stays bounded no matter how large the document is. Anything
+    smaller than a single part is sent with one put_object.
+    """
+    buffer = bytearray()
+    upload_id = None
+    parts = []
+    futures = []
+    slots = threading.BoundedSemaphore(max_concurrency)
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def upload_part(number, body):
+        try:
+            response = s3_client.upload_part(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=number,
+                Body=body,
+            )
+            return {"PartNumber": number, "ETag": response["ETag"]}
+        finally:
+            slots.release()
+
+    def submit(body):
+        # Blocks the download while every upload slot is busy
+        slots.acquire()
+        # A failed part frees its slot, stop the download as soon as one does
+        for future in futures:
+            if future.done() and future.exception() is not None:
+                slots.release()
+                raise future.exception()
+        futures.append(executor.submit(upload_part, len(futures) + 1, bytes(body)))
+
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            buffer.extend(chunk)
+            if len(buffer) < part_size:
+                continue
+            if upload_id is None:
+                upload_id = s3_client.create_multipart_upload(
+                    Bucket=bucket, Key=key, ContentType=content_type
+                )["UploadId"]
+            submit(buffer)
+            buffer = bytearray()
+
+        if upload_id is None:
+            s3_client.put_object(
+                Bucket=bucket, Key=key, Body=bytes(buffer), ContentType=content_type
+            )
+            return key
+
+        if buffer:
+            submit(buffer)
+        parts = [future.result() for future in futures]
+        s3_client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+        return key
+    except Exception:
+        if upload_id is not None:
+            # Let in flight parts settle so the abort leaves nothing behind
+            executor.shutdown(wait=True)
+            s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    finally:
+        executor.shutdown(wait=True)
+
+
+def upload_pdf(response, s3_client, bucket, key=None):
+    """Stream a Bluemoon PDF response into S3 and return the key."""
+    if key is None:
+        key = pdf_key()
+    try:
+        return upload_stream(
+            response.iter_content(chunk_size=S3_CHUNK_SIZE),
+            s3_client=s3_client,
+            bucket=bucket,
+            key=key,
+        )
+    finally:
+        response.close()
@@ -1,11 +1,39 @@
+import base64
+import binascii
 import json
 import gzip
 import math
 from chalice import Response
+from sqlalchemy import and_, or_
 
+from chalicelib.cache import TTLCache
 from chalicelib.database import DatabaseConnection
 from chalicelib.bluemoon_api import BluemoonApi
-from chalicelib.exceptions import MissingLeaseFormsException
+from chalicelib.exceptions import InvalidCursorException, MissingLeaseFormsException
+from chalicelib.instrumentation import span
+from chalicelib.settings import (
+    GZIP_LEVEL,
+    GZIP_MIN_SIZE,
+    TOTAL_CACHE_SIZE,
+    TOTAL_CACHE_TTL,
+)
+
+try:
+    import orjson
+except ImportError:
+    # orjson is an optional, faster encoder
+    orjson = None
+
+# Row counts per user and filter set, see ModelFilter.count. Writes bump the
+# generation for the user so stale totals are never looked up again.
+total_cache = TTLCache(maxsize=TOTAL_CACHE_SIZE, ttl=TOTAL_CACHE_TTL)
+_total_generations = {}
+
+
+def invalidate_totals(model, user_id):
+    """Forget the cached totals after the user's rows changed."""
+    key = (model.__tablename__, str(user_id))
+    _total_generations[key] = _total_generations.get(key, 0) + 1
 
 
 def get_token(request):
@@ -15,93 +43,294 @@ def get_token(request):
         pass
 
 
-def gzip_response(data, status_code, headers={}):
-    blob = json.dumps(data).encode("utf-8")
-    payload = gzip.compress(blob)
+def json_dumps(data):
+    """Encode JSON to bytes, with orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # e.g. non string keys, which the stdlib encoder converts
+            pass
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def accepts_gzip(request):
+    """Whether the request's Accept-Encoding allows a gzip body.
+
+    Without a request gzip is assumed, as before negotiation. gzip_response
+    still sends bodies under GZIP_MIN_SIZE uncompressed either way.
+    """
+    if request is None:
+        return True
+    accept_encoding = (request.headers or {}).get("accept-encoding")
+    if not accept_encoding:
+        return False
+
+    codings = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        codings[coding.strip().lower()] = quality
+    if "gzip" in codings:
+        return codings["gzip"] > 0
+    return codings.get("*", 0) > 0
+
+
+def gzip_response(data, status_code, headers=None, request=None):
+    """JSON response, gzipped when the client accepts it and it pays off."""
+    headers = dict(headers or {})
+    with span("encode") as encoded:
+        blob = json_dumps(data)
+        encoded.set(bytes=len(blob))
     headers["Content-Type"] = "application/json"
+    headers["Vary"] = "Accept-Encoding"
+    if len(blob) < GZIP_MIN_SIZE or not accepts_gzip(request):
+        return Response(
+            body=blob.decode("utf-8"), status_code=status_code, headers=headers
+        )
+
+    with span("gzip") as compressed:
+        payload = gzip.compress(blob, compresslevel=GZIP_LEVEL)
+        compressed.set(bytes=len(payload))
     headers["Content-Encoding"] = "gzip"
-
     return Response(body=payload, status_code=status_code, headers=headers)
 
 
-def api_error_response():
+def api_error_response(request=None):
     return gzip_response(
-        data={"message": "Unable to retrieve api data."}, status_code=500
+        data={"message": "Unable to retrieve api data."},
+        status_code=500,
+        request=request,
     )
 
 
-def forms_mapper(selected_forms, token):
-    bm_api = BluemoonApi(token=token)
-    lease_forms = bm_api.lease_forms()
-    if not lease_forms:
+def forms_mapper(selected_forms, token, catalog=None):
+    """Forms grouped by type, catalog skips the lookup when already fetched."""
+    if catalog is None:
+        catalog = BluemoonApi(token=token).forms_catalog()
+    if not catalog.forms:
         raise MissingLeaseFormsException()
 
-    standard_selections = [
-        lease_form["name"]
-        for lease_form in lease_forms
-        if lease_form["type"] == "standard"
-    ]
-    custom_selections = [
-        lease_form["name"]
-        for lease_form in lease_forms
-        if lease_form["type"] == "custom"
-    ]
-    standard_forms = [
-        form_name for form_name in selected_forms if form_name in standard_selections
-    ]
-    custom_forms = [
-        form_name for form_name in selected_forms if form_name in custom_selections
-    ]
-    return {'standard_forms': standard_forms, 'custom_forms': custom_forms}
+    return catalog.classify(selected_forms or [])
+
+
+def page_count(total, page_size):
+    if total is None:
+        return None
+    return int(math.ceil(total / float(page_size)))
 
 
 class Page(object):
-    def __init__(self, items, page, page_size, total):
+    def __init__(self, items, page, page_size, total, has_next=None):
         self.items = items
         self.previous_page = None
         self.next_page = None
         self.has_previous = page > 1
         if self.has_previous:
             self.previous_page = page - 1
-        previous_items = (page - 1) * page_size
-        self.has_next = previous_items + len(items) < total
+        if has_next is None:
+            previous_items = (page - 1) * page_size
+            has_next = previous_items + len(items) < total
+        self.has_next = has_next
         if self.has_next:
             self.next_page = page + 1
         self.total = total
-        self.pages = int(math.ceil(total / float(page_size)))
+        self.pages = page_count(total, page_size)
+
+
+class CursorPage(object):
+    """Keyset page, next_cursor continues after the last item."""
+
+    def __init__(self, items, page_size, total, has_previous, next_cursor):
+        self.items = items
+        self.previous_page = None
+        self.next_page = None
+        self.has_previous = has_previous
+        self.has_next = next_cursor is not None
+        self.next_cursor = next_cursor
+        self.total = total
+        self.pages = page_count(total, page_size)
 
 
 class ModelFilter(object):
     sort_directions = ["asc", "desc"]
+    # exact counts every time, estimate reuses a cached count, none skips it
+    total_modes = ["exact", "estimate", "none"]
 
-    def __init__(self, filters, model, user_id, params=None):
+    def __init__(self, filters, model, user_id, params=None, options=None):
+        """options are loader options applied to the query, e.g. selectinload
+        for relationships the results are serialized with or defer for
+        columns they don't need."""
         self.filters = filters
         self.params = params
         self.user_id = user_id
         if not params:
             self.params = {}
         self.model = model
+        self.options = options or []
         self.query = None
+        self.sort_field = None
+        self.sort_dir = None
+        # Set by count when the total came from total_cache
+        self.total_cached = False
 
-    def paginate(self):
-        """Paginate the query data."""
+    def page_size(self):
         try:
-            page_size = int(
-                self.params.get("page_size", self.filters["default_page_size"])
-            )
+            return int(self.params.get("page_size", self.filters["default_page_size"]))
         except ValueError:
-            page_size = self.filters["default_page_size"]
+            return self.filters["default_page_size"]
+
+    def total_mode(self):
+        mode = self.params.get("total", self.filters.get("default_total", "exact"))
+        if mode not in self.total_modes:
+            mode = self.filters.get("default_total", "exact")
+        return mode
+
+    def total_key(self):
+        """Cache key for the user's normalized filter set."""
+        generation_key = (self.model.__tablename__, str(self.user_id))
+        applied = sorted(
+            (field, value)
+            for field, value in self.params.items()
+            if field in self.filters["fields"] and ":" in value
+        )
+        return generation_key + (
+            _total_generations.get(generation_key, 0),
+            tuple(applied),
+        )
+
+    def count(self):
+        """Total rows for the filters, None when the client skipped it."""
+        mode = self.total_mode()
+        if mode == "none":
+            return None
+        key = self.total_key()
+        if mode == "estimate":
+            total = total_cache.get(key)
+            if total is not None:
+                self.total_cached = True
+                return total
+        total = self.query.order_by(None).count()
+        total_cache.set(key, total)
+        return total
+
+    def paginate(self):
+        """Paginate the query data."""
+        if "cursor" in self.params and self.sort_field:
+            return self.paginate_cursor()
 
+        page_size = self.page_size()
         try:
             page = int(self.params.get("page", 1))
         except ValueError:
             page = 1
-        items = self.query.limit(page_size).offset((page - 1) * page_size).all()
-        total = self.query.order_by(None).count()
-        return Page(items, page, page_size, total)
-
-    def ordering(self):
-        """Process the query ordering."""
+        total = self.count()
+        if total is not None and not self.total_cached:
+            items = self.query.limit(page_size).offset((page - 1) * page_size).all()
+            return Page(items, page, page_size, total)
+
+        # Without a total one extra row tells us whether there is a next page. A
+        # cached total can miss rows written through another container, the
+        # generation bump only reaches the process that made the change.
+        items = self.query.limit(page_size + 1).offset((page - 1) * page_size).all()
+        return Page(
+            items[:page_size], page, page_size, total, has_next=len(items) > page_size
+        )
+
+    def paginate_cursor(self):
+        """Keyset pagination, continues after the row encoded in the cursor.
+
+        Passing an empty cursor starts from the first row, a malformed one raises
+        InvalidCursorException. Unlike offsets the database seeks straight to
+        the position so every page costs the same.
+        """
+        page_size = self.page_size()
+        cursor = self.decode_cursor(self.params.get("cursor"))
+        query = self.query
+        if cursor is not None:
+            query = query.filter(self.keyset_filter(*cursor))
+        # One extra row tells us whether there is a next page
+        items = query.limit(page_size + 1).all()
+        next_cursor = None
+        if len(items) > page_size:
+            items = items[:page_size]
+            next_cursor = self.encode_cursor(items[-1])
+        return CursorPage(
+            items, page_size, self.count(), cursor is not None, next_cursor
+        )
+
+    def encode_cursor(self, item):
+        """Opaque token for the position of the item in the current ordering."""
+        position = [
+            self.sort_field,
+            self.sort_dir,
+            getattr(item, self.sort_field),
+            item.id,
+        ]
+        blob = json.dumps(position).encode("utf-8")
+        return base64.urlsafe_b64encode(blob).decode("ascii")
+
+    def decode_cursor(self, cursor):
+        """(value, id) from a cursor, None if missing.
+
+        Raises InvalidCursorException for a malformed cursor or one from
+        another ordering, restarting at the first row would loop the client.
+        """
+        if not cursor:
+            return None
+        try:
+            blob = base64.urlsafe_b64decode(cursor.encode("ascii"))
+            sort_field, sort_dir, value, last_id = json.loads(blob.decode("utf-8"))
+        except (binascii.Error, UnicodeError, ValueError, TypeError):
+            raise InvalidCursorException("Malformed cursor")
+        # Anything else would reach the query as a bind parameter
+        if not isinstance(last_id, int) or isinstance(last_id, bool):
+            raise InvalidCursorException("Malformed cursor")
+        if value is not None and (
+            isinstance(value, bool) or not isinstance(value, (str, int))
+        ):
+            raise InvalidCursorException("Malformed cursor")
+        if sort_field != self.sort_field or sort_dir != self.sort_dir:
+            raise InvalidCursorException("Cursor is from another ordering")
+        return value, last_id
+
+    def keyset_filter(self, value, last_id):
+        """Rows after (value, id) in the current ordering.
+
+        MySQL sorts nulls first ascending and last descending, the null
+        branches follow that.
+        """
+        id_attr = self.model.id
+        if self.sort_field == "id":
+            return id_attr > last_id if self.sort_dir == "asc" else id_attr < last_id
+
+        attr = getattr(self.model, self.sort_field)
+        if self.sort_dir == "asc":
+            if value is None:
+                return or_(and_(attr == None, id_attr > last_id), attr != None)  # noqa
+            return or_(attr > value, and_(attr == value, id_attr > last_id))
+
+        if value is None:
+            return and_(attr == None, id_attr < last_id)  # noqa
+        return or_(
+            attr < value, and_(attr == value, id_attr < last_id), attr == None  # noqa
+        )
+
+    def check_cursor(self):
+        """Raise InvalidCursorException now rather than from results, for
+        callers that write before listing."""
+        if self.params.get("cursor"):
+            self.sort_field, self.sort_dir = self.sort_order()
+            self.decode_cursor(self.params["cursor"])
+
+    def sort_order(self):
+        """(field, direction) requested, falling back to the defaults."""
         sort_dir = self.params.get("order_dir", self.filters["default_dir"])
         if sort_dir not in self.sort_directions:
             sort_dir = self.filters["default_dir"]
@@ -109,15 +338,25 @@ class ModelFilter(object):
         sort_field = self.params.get("order_by", self.filters["default_order"])
         if sort_field not in self.filters["fields"]:
             sort_field = self.filters["default_order"]
+        return sort_field, sort_dir
 
+    def ordering(self):
+        """Process the query ordering."""
+        sort_field, sort_dir = self.sort_order()
         try:
             sort_attr = getattr(self.model, sort_field)
         except AttributeError:
             pass
         else:
+            self.sort_field = sort_field
+            self.sort_dir = sort_dir
+            order = [sort_attr]
+            # The id breaks ties so rows keep a stable position between pages
+            if sort_field != "id":
+                order.append(self.model.id)
             if sort_dir == "desc":
-                sort_attr = sort_attr.desc()
-            self.query = self.query.order_by(sort_attr)
+                order = [attr.desc() for attr in order]
+            self.query = self.query.order_by(*order)
 
     def filtering(self):
         """Filter the model."""
@@ -187,7 +426,7 @@ class ModelFilter(object):
     def results(self):
         db = DatabaseConnection()
         session = db.session()
-        self.query = session.query(self.model)
+        self.query = session.query(self.model).options(*self.options)
         self.filtering()
         self.ordering()
         return self.paginate()
@@ -0,0 +1,14 @@
+import pytest
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Empty SQLite database that DatabaseConnection points at."""
+    monkeypatch.setenv("DATABASE_URL", "sqlite:///{}".format(tmp_path / "test.db"))
+    from chalicelib.database import DatabaseConnection, remove_sessions
+    from chalicelib.models import Base
+
+    db = DatabaseConnection()
+    Base.metadata.create_all(db.engine())
+    yield db
+    remove_sessions()
@@ -0,0 +1,54 @@
+from unittest import mock
+
+import pytest
+from hypothesis import given
+from hypothesis import strategies as st
+
+from chalicelib import bulk
+from chalicelib.models import derive_status
+
+signer = st.fixed_dictionaries(
+    {},
+    optional={
+        "identifier": st.sampled_from(["resident", "owner", "guarantor"]),
+        "completed": st.one_of(st.booleans(), st.integers(0, 1), st.none()),
+    },
+)
+# Mostly well formed lists, with missing keys and missing lists mixed in
+signers_payload = st.one_of(
+    st.lists(
+        st.fixed_dictionaries(
+            {
+                "identifier": st.sampled_from(["resident", "owner"]),
+                "completed": st.booleans(),
+            }
+        ),
+        max_size=6,
+    ),
+    st.lists(signer, max_size=6),
+    st.none(),
+)
+
+
+def expected_status(signers_data):
+    try:
+        return derive_status(signers_data)
+    except (KeyError, TypeError):
+        return None
+
+
+@pytest.mark.parametrize(
+    "numpy",
+    [
+        pytest.param(
+            "installed",
+            marks=pytest.mark.skipif(bulk.numpy is None, reason="needs numpy"),
+        ),
+        pytest.param(None, id="python"),
+    ],
+)
+@given(payloads=st.lists(signers_payload, max_size=30))
+def test_derive_statuses_matches_derive_status(numpy, payloads):
+    with mock.patch.object(bulk, "numpy", bulk.numpy if numpy else None):
+        statuses = bulk.derive_statuses(payloads)
+    assert statuses == [expected_status(payload) for payload in payloads]
@@ -0,0 +1,114 @@
+import base64
+import json
+import types
+
+import pytest
+
+import app
+from chalicelib.exceptions import InvalidCursorException
+from chalicelib.models import Lease, User
+
+UNIT_NUMBERS = ["B", None, "A", "C", None, "B", "A", None, "D", "B"]
+
+
+@pytest.fixture
+def leases(database):
+    """User 1 with ten leases, duplicate and NULL unit numbers included."""
+    session = database.session(new=True)
+    session.add(User(id=1, username="user1", access_token="token-user1"))
+    for lease_id, unit_number in enumerate(UNIT_NUMBERS, start=1):
+        session.add(Lease(id=lease_id, user_id=1, unit_number=unit_number))
+    session.commit()
+    session.close()
+    return database
+
+
+def page(**params):
+    request = types.SimpleNamespace(query_params=params)
+    return app.lease_page(request, user_id=1)
+
+
+def walk(**params):
+    """Every id by following next_cursor from the first page."""
+    ids = []
+    cursor = ""
+    while cursor is not None:
+        data = page(cursor=cursor, page_size="3", **params)
+        ids.extend(item["id"] for item in data["items"])
+        cursor = data.get("next_cursor")
+    return ids
+
+
+def encode(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode()
+
+
+def expected_order(descending):
+    # MySQL (and SQLite) sort NULLs first ascending and last descending
+    leases = list(enumerate(UNIT_NUMBERS, start=1))
+    leases.sort(key=lambda lease: (lease[1] is not None, lease[1] or "", lease[0]))
+    if descending:
+        leases.reverse()
+    return [lease_id for lease_id, _ in leases]
+
+
+@pytest.mark.parametrize("order_dir", ["asc", "desc"])
+def test_cursor_walk_by_unit_number(leases, order_dir):
+    ids = walk(order_by="unit_number", order_dir=order_dir)
+    assert ids == expected_order(descending=order_dir == "desc")
+
+
+@pytest.mark.parametrize("order_dir", ["asc", "desc"])
+def test_cursor_walk_by_id(leases, order_dir):
+    ids = walk(order_by="id", order_dir=order_dir)
+    assert ids == sorted(ids, reverse=order_dir == "desc")
+    assert sorted(ids) == list(range(1, len(UNIT_NUMBERS) + 1))
+
+
+def test_cursor_from_another_ordering(leases):
+    cursor = page(cursor="", page_size="3", order_by="unit_number")["next_cursor"]
+    with pytest.raises(InvalidCursorException):
+        page(cursor=cursor, page_size="3", order_by="unit_number", order_dir="asc")
+    with pytest.raises(InvalidCursorException):
+        page(cursor=cursor, page_size="3", order_by="id")
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "garbage!!",
+        base64.urlsafe_b64encode(b"not json").decode(),
+        encode(["id", "desc", 5]),
+        encode(["id", "desc", None, {"a": 1}]),
+        encode(["id", "desc", None, "5"]),
+        encode(["unit_number", "desc", ["B"], 3]),
+        encode(["unit_number", "desc", {"a": 1}, 3]),
+    ],
+    ids=[
+        "not-base64",
+        "not-json",
+        "short",
+        "dict-id",
+        "str-id",
+        "list-value",
+        "dict-value",
+    ],
+)
+def test_malformed_cursor(leases, cursor):
+    with pytest.raises(InvalidCursorException):
+        page(cursor=cursor, order_by="unit_number")
+
+
+def test_bad_cursor_rejected_before_create(leases):
+    app.app.current_request = types.SimpleNamespace(
+        method="POST",
+        context={"authorizer": {"principalId": 1}},
+        json_body={"unit_number": "N-1"},
+        query_params={"cursor": "garbage!!"},
+        headers={},
+    )
+    response = app.leases()
+    assert response.status_code == 400
+    session = leases.session(new=True)
+    assert session.query(Lease).filter(Lease.unit_number == "N-1").count() == 0
+    session.close()
@@ -0,0 +1,39 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from chalicelib.http_client import build_session
+
+
+class CookieHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.received.append(self.headers.get("Cookie"))
+        self.send_response(200)
+        self.send_header("Set-Cookie", "session=user1; Path=/")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(("127.0.0.1", 0), CookieHandler)
+    server.received = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_session_does_not_keep_cookies(server):
+    session = build_session()
+    url = "http://127.0.0.1:{}/".format(server.server_port)
+    session.get(url)
+    session.get(url)
+
+    assert len(session.cookies) == 0
+    assert server.received == [None, None]
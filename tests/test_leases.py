@@ -0,0 +1,54 @@
+import types
+
+import pytest
+from sqlalchemy import event
+
+import app
+from chalicelib.models import Lease, LeaseEsignature, StatusEnum, User
+
+
+@pytest.fixture
+def leases(database):
+    """User 1 with 100 leases, each with two esignatures."""
+    session = database.session(new=True)
+    session.add(User(id=1, username="user1", access_token="token-user1"))
+    for lease_id in range(1, 101):
+        session.add(Lease(id=lease_id, user_id=1, unit_number="U-{}".format(lease_id)))
+        for _ in range(2):
+            session.add(
+                LeaseEsignature(
+                    lease_id=lease_id, bluemoon_id=lease_id, status=StatusEnum.signed
+                )
+            )
+    session.commit()
+    session.close()
+    return database
+
+
+def count_queries(engine, func):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        result = func()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return result, len(statements)
+
+
+@pytest.mark.parametrize("expand", ["", "esignatures"])
+def test_lease_page_queries_do_not_grow_with_page_size(leases, expand):
+    counts = {}
+    for page_size in (25, 100):
+        # total=exact runs the count query on both pages, not just the first
+        params = {"page_size": str(page_size), "total": "exact", "expand": expand}
+        request = types.SimpleNamespace(query_params=params)
+        data, counts[page_size] = count_queries(
+            leases.engine(), lambda: app.lease_page(request, user_id=1)
+        )
+        assert len(data["items"]) == page_size
+        assert all(len(item["esignatures"]) == 2 for item in data["items"])
+    assert counts[25] == counts[100]
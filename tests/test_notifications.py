@@ -0,0 +1,71 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from chalicelib.models import Lease, LeaseEsignature, StatusEnum, User
+from chalicelib.notifications import (
+    apply_notifications,
+    is_duplicate,
+    recent_payloads,
+)
+
+
+def payload(bluemoon_id, completed):
+    signers = [
+        {"identifier": "resident", "completed": completed},
+        {"identifier": "owner", "completed": False},
+    ]
+    return {"id": bluemoon_id, "esign": {"data": {"signers": {"data": signers}}}}
+
+
+@pytest.fixture
+def esignature(database):
+    session = database.session(new=True)
+    session.add(User(id=1, username="user1", access_token="token-user1"))
+    session.add(Lease(id=1, user_id=1, bluemoon_id=7))
+    session.add(LeaseEsignature(id=1, lease_id=1, bluemoon_id=7))
+    session.commit()
+    session.close()
+    recent_payloads.clear()
+    yield database
+    recent_payloads.clear()
+
+
+def stored(database):
+    session = database.session(new=True)
+    try:
+        lease_esignature = session.query(LeaseEsignature).get(1)
+        return lease_esignature.status, lease_esignature.data_digest
+    finally:
+        session.close()
+
+
+def test_failed_commit_is_not_remembered_as_duplicate(esignature, monkeypatch):
+    data = payload(7, completed=True)
+    session = esignature.session(new=True)
+
+    def commit():
+        raise OperationalError("COMMIT", {}, Exception("database went away"))
+
+    monkeypatch.setattr(session, "commit", commit)
+    with pytest.raises(OperationalError):
+        apply_notifications(session, {7: data})
+    session.rollback()
+    session.close()
+
+    # Bluemoon retries, the retry has to be applied rather than acknowledged
+    assert not is_duplicate(data)
+    assert stored(esignature) == (StatusEnum.pending, None)
+
+    session = esignature.session(new=True)
+    assert apply_notifications(session, {7: data}) == set()
+    session.close()
+    assert is_duplicate(data)
+    status, digest = stored(esignature)
+    assert status == StatusEnum.signed
+    assert digest is not None
+
+
+def test_unknown_ids_are_returned(esignature):
+    session = esignature.session(new=True)
+    assert apply_notifications(session, {8: payload(8, completed=True)}) == {8}
+    session.close()
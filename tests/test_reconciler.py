@@ -0,0 +1,72 @@
+import datetime
+
+import pytest
+
+from chalicelib import reconciler
+from chalicelib.models import Lease, LeaseEsignature, StatusEnum, User
+
+
+def details(completed):
+    signers = [
+        {"identifier": "resident", "completed": completed},
+        {"identifier": "owner", "completed": False},
+    ]
+    return {"data": {"esign": {"data": {"signers": {"data": signers}}}}}
+
+
+@pytest.fixture
+def esignatures(database):
+    session = database.session(new=True)
+    expires = datetime.datetime.now() + datetime.timedelta(days=1)
+    session.add(User(id=1, username="user1", access_token="token", expires=expires))
+    for number in range(1, 6):
+        session.add(Lease(id=number, user_id=1, bluemoon_id=number))
+        session.add(LeaseEsignature(id=number, lease_id=number, bluemoon_id=number))
+    session.commit()
+    session.close()
+    return database
+
+
+def statuses(database):
+    session = database.session(new=True)
+    try:
+        return {
+            lease_esignature.id: lease_esignature.status
+            for lease_esignature in session.query(LeaseEsignature)
+        }
+    finally:
+        session.close()
+
+
+def test_results_are_committed_in_chunks(esignatures, monkeypatch):
+    def fetch(rows, concurrency, rate):
+        for row in rows[:4]:
+            yield row, details(completed=True)
+        raise RuntimeError("Lambda timed out")
+
+    monkeypatch.setattr(reconciler, "fetch_threaded", fetch)
+    with pytest.raises(RuntimeError):
+        reconciler.reconcile(
+            session=esignatures.session(new=True), min_age=0, commit_size=2
+        )
+
+    stored = statuses(esignatures)
+    assert [stored[number] for number in range(1, 5)] == [StatusEnum.signed] * 4
+    assert stored[5] == StatusEnum.pending
+
+
+def test_errors_are_counted_and_the_rest_stored(esignatures, monkeypatch):
+    def fetch(rows, concurrency, rate):
+        for row in rows:
+            if row.id == 3:
+                yield row, RuntimeError("Bluemoon is down")
+            else:
+                yield row, details(completed=True)
+
+    monkeypatch.setattr(reconciler, "fetch_threaded", fetch)
+    results = reconciler.reconcile(
+        session=esignatures.session(new=True), min_age=0, commit_size=2
+    )
+
+    assert results == {"checked": 5, "updated": 4, "errors": 1}
+    assert statuses(esignatures)[3] == StatusEnum.pending
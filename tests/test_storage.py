@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+from chalicelib.storage import upload_stream
+
+
+class FakeS3:
+    def __init__(self, fail_part=None):
+        self.fail_part = fail_part
+        self.parts = {}
+        self.put = None
+        self.completed = None
+        self.aborted = False
+        self.lock = threading.Lock()
+
+    def create_multipart_upload(self, **kwargs):
+        return {"UploadId": "upload"}
+
+    def upload_part(self, PartNumber, Body, **kwargs):
+        if PartNumber == self.fail_part:
+            raise RuntimeError("part {} failed".format(PartNumber))
+        with self.lock:
+            self.parts[PartNumber] = Body
+        return {"ETag": str(PartNumber)}
+
+    def complete_multipart_upload(self, MultipartUpload, **kwargs):
+        self.completed = MultipartUpload["Parts"]
+
+    def put_object(self, Body, **kwargs):
+        self.put = Body
+
+    def abort_multipart_upload(self, **kwargs):
+        self.aborted = True
+
+
+def test_parts_are_uploaded_in_order():
+    s3_client = FakeS3()
+    chunks = [bytes([number]) * 4 for number in range(10)]
+
+    upload_stream(iter(chunks), s3_client, "bucket", "key", part_size=8)
+
+    assert [part["PartNumber"] for part in s3_client.completed] == list(range(1, 6))
+    body = b"".join(s3_client.parts[number] for number in sorted(s3_client.parts))
+    assert body == b"".join(chunks)
+
+
+def test_small_stream_is_put_in_one_call():
+    s3_client = FakeS3()
+
+    upload_stream(iter([b"abc", b"def"]), s3_client, "bucket", "key")
+
+    assert s3_client.put == b"abcdef"
+    assert s3_client.completed is None
+
+
+def test_failed_part_stops_the_download_and_aborts():
+    s3_client = FakeS3(fail_part=1)
+    consumed = []
+
+    def chunks():
+        for number in range(1000):
+            consumed.append(number)
+            yield b"x" * 8
+
+    with pytest.raises(RuntimeError):
+        upload_stream(chunks(), s3_client, "bucket", "key", part_size=8)
+
+    assert s3_client.aborted
+    assert s3_client.completed is None
+    assert len(consumed) < 1000